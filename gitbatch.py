@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+# Object reads from local repositories through one long-lived
+# git cat-file --batch process per repository, instead of a git process
+# per read.
+
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Batch(object):
+    """A git cat-file --batch process serving object reads from one
+    repository.  Object names are resolved by git on every request, so
+    refs moved and objects fetched after the process started are seen.
+    If the repository directory is removed or replaced, reads fail with
+    OSError instead of reporting objects as missing.  Safe to share between
+    threads.
+
+    :param gitdir: The repository directory
+    """
+
+    def __init__(self, gitdir):
+        self.gitdir = gitdir
+        self._lock = threading.Lock()
+        self._proc = None
+        self._identity = None
+
+    def _check(self):
+        """Raises OSError if the repository the process was started in is
+        gone or was replaced by another one."""
+        try:
+            st = os.stat(self.gitdir)
+        except OSError as e:
+            raise OSError("Repository {} is gone: {}".format(self.gitdir, e))
+        if self._identity is not None and self._identity != (st.st_dev, st.st_ino):
+            raise OSError("Repository {} was replaced".format(self.gitdir))
+        return st.st_dev, st.st_ino
+
+    def _start(self):
+        self._identity = self._check()
+        self._proc = subprocess.Popen(
+            ["git", "-C", self.gitdir, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def object(self, name):
+        """Reads an object.
+
+        :param name: Any object name git understands, such as a commit
+        hash, a ref or rev:path
+        :returns: An (object id, type, content bytes) tuple, or None if the
+        object does not exist
+        """
+        if "\n" in name:
+            raise ValueError("Invalid object name {!r}".format(name))
+        with self._lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self._start()
+            else:
+                self._check()
+            try:
+                self._proc.stdin.write(name.encode("utf-8") + b"\n")
+                self._proc.stdin.flush()
+                header = self._proc.stdout.readline().decode("utf-8")
+                if not header:
+                    raise EOFError("git cat-file exited")
+                if header.rstrip("\n").endswith((" missing", " ambiguous")):
+                    return None
+                oid, otype, size = header.split()
+                data = self._proc.stdout.read(int(size) + 1)[:-1]
+            except Exception:
+                # the stream is out of sync, start over on the next read
+                self._stop()
+                raise
+            return oid, otype, data
+
+    def resolve(self, ref):
+        """Resolves a ref to a commit hash, or None if it does not exist."""
+        obj = self.object("{}^{{commit}}".format(ref))
+        return obj[0] if obj else None
+
+    def has(self, name):
+        """Returns whether an object exists in the repository."""
+        return self.object(name) is not None
+
+    def blob(self, rev, path):
+        """Reads a file at a revision.
+
+        :param rev: The commit, branch or tag
+        :param path: The path of the file in the repository
+        :returns: The file content as a string, or None if there is no such
+        file
+        """
+        obj = self.object("{}:{}".format(rev, path))
+        if obj is None or obj[1] != "blob":
+            return None
+        return obj[2].decode("utf-8")
+
+    def blob_id(self, rev, path):
+        """Returns the object id of a file at a revision, or None."""
+        obj = self.object("{}:{}".format(rev, path))
+        return obj[0] if obj and obj[1] == "blob" else None
+
+    def _stop(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self._proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        self._proc.stdout.close()
+        self._proc = None
+        self._identity = None
+
+    def close(self):
+        """Stops the git process."""
+        with self._lock:
+            self._stop()
+
+
+def hash_blob(data):
+    """Returns the object id git gives a blob with the given content, like
+    git hash-object.
+
+    :param data: The content, as bytes
+    """
+    digest = hashlib.sha1(b"blob %d\0" % len(data))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def engine(gitdir):
+    """Returns the shared Batch of a repository, starting it on first use.
+
+    :param gitdir: The repository directory
+    """
+    gitdir = os.path.abspath(gitdir)
+    with _engines_lock:
+        batch = _engines.get(gitdir)
+        if batch is None:
+            batch = _engines[gitdir] = Batch(gitdir)
+        return batch
+
+
+def release(gitdir):
+    """Stops the shared Batch of a repository, if there is one.  Called
+    before a repository is given up, as it may be removed afterwards."""
+    with _engines_lock:
+        batch = _engines.pop(os.path.abspath(gitdir), None)
+    if batch is not None:
+        batch.close()
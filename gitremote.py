@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+# Lightweight reads from remote git repositories that do not need a clone
+# or a working tree.
+
+import io
+import logging
+import re
+import subprocess
+import tarfile
+
+logger = logging.getLogger(__name__)
+
+# a full commit hash
+SHARE = re.compile(r"^[0-9a-f]{40}$")
+
+
+def ls_remote(link, ref, timeout=120):
+    """Resolves a branch or tag of a remote repository to a commit hash
+    using git ls-remote.  Full commit hashes are returned as is.
+
+    :param link: The repository URL
+    :param ref: The branch, tag or commit hash
+    :param timeout: The timeout in seconds
+    :returns: The commit hash, or None if the ref does not exist
+    :raises subprocess.CalledProcessError: If the remote could not be read
+    """
+    if SHARE.match(ref):
+        return ref
+    out = subprocess.run(
+        [
+            "git",
+            "ls-remote",
+            link,
+            "refs/heads/{}".format(ref),
+            "refs/tags/{}".format(ref),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        timeout=timeout,
+        check=True,
+    ).stdout
+    for line in out.splitlines():
+        sha, _, name = line.partition("\t")
+        if name in ("refs/heads/{}".format(ref), "refs/tags/{}".format(ref)):
+            return sha
+    return None
+
+
+def read_file(link, ref, path, url=None, commit=None, timeout=120):
+    """Reads a single file from a remote repository at the given ref.
+
+    If url is given, the file is fetched with a plain HTTP GET, which is
+    what the web frontends of most git hosts offer.  Otherwise git archive
+    --remote is used, which requires the server to allow upload-archive.
+    Servers only archive advertised refs, so ref should be a branch or tag
+    name; if commit is given, the archived commit is checked against it.
+
+    :param link: The repository URL
+    :param ref: The branch or tag
+    :param path: The path of the file in the repository
+    :param url: An optional URL serving the raw file content
+    :param commit: The commit hash ref is expected to point to
+    :param timeout: The timeout in seconds
+    :returns: The file content as a string, or None if the file does not exist
+    :raises ValueError: If ref no longer points to commit
+    :raises Exception: If the remote could not be read
+    """
+    if url:
+        import lookaside
+
+        resp = lookaside.session().get(url, timeout=timeout)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.text
+    proc = subprocess.run(
+        ["git", "archive", "--format=tar", "--remote={}".format(link), ref, path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=timeout,
+    )
+    if proc.returncode != 0:
+        if b"did not match any files" in proc.stderr:
+            return None
+        raise subprocess.CalledProcessError(
+            proc.returncode, proc.args, proc.stdout, proc.stderr
+        )
+    with tarfile.open(fileobj=io.BytesIO(proc.stdout)) as tar:
+        content = tar.extractfile(path).read().decode("utf-8")
+        # git archive records the commit it archived in the global header
+        archived = tar.pax_headers.get("comment")
+    if commit and archived != commit:
+        raise ValueError(
+            "{} of {} is at {}, expected {}".format(ref, link, archived, commit)
+        )
+    return content
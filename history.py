@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+
+# Run history of the import scripts, kept in a local SQLite database.
+#
+# Usage: history.py [--db PATH] [--window N] [--threshold RATIO] [component ...]
+
+import argparse
+import logging
+import os
+import sqlite3
+import statistics
+import threading
+import time
+
+import logsink
+import progress
+
+logger = logging.getLogger(__name__)
+
+# the database used when none is given
+default_db = "/home/merlinm/stream-module-testing/history.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    script TEXT,
+    args TEXT,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run INTEGER REFERENCES runs(id),
+    component TEXT,
+    phase TEXT,
+    started REAL,
+    duration REAL,
+    bytes INTEGER,
+    outcome TEXT,
+    job TEXT
+);
+CREATE INDEX IF NOT EXISTS phases_component ON phases (component, phase);
+"""
+
+# the job name column was added later; databases created before are
+# upgraded when opened
+UPGRADE = "ALTER TABLE phases ADD COLUMN job TEXT"
+
+
+class History(object):
+    """A SQLite database of import runs and the per-component, per-phase
+    timings recorded during them.  Components are kept apart by job, as
+    the same component imported into different branches takes different
+    times.  Safe to share between threads.
+
+    :param path: The database file
+    """
+
+    def __init__(self, path=default_db):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(phases)")]
+        if "job" not in columns:
+            with self._db:
+                self._db.execute(UPGRADE)
+        self._lock = threading.Lock()
+
+    def start_run(self, script, args):
+        """Records the start of a run.
+
+        :param script: The name of the script
+        :param args: The command line arguments
+        :returns: A Run object to record phases with
+        """
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT INTO runs (script, args, started) VALUES (?, ?, ?)",
+                (script, " ".join(args), time.time()),
+            )
+        return Run(self, cur.lastrowid)
+
+    def record(
+        self, run, component, phase, started, duration, nbytes, outcome, job=None
+    ):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO phases (run, component, phase, started, duration, "
+                "bytes, outcome, job) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run, component, phase, started, duration, nbytes, outcome, job),
+            )
+
+    def finish_run(self, run):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE runs SET finished = ? WHERE id = ?", (time.time(), run)
+            )
+
+    def timings(self, component=None):
+        """Returns the successful phase timings, oldest first, as a dict of
+        (job, component, phase) to a list of (run, duration, bytes) tuples."""
+        query = (
+            "SELECT job, component, phase, run, duration, bytes FROM phases "
+            "WHERE outcome = 'ok'"
+        )
+        params = ()
+        if component:
+            query += " AND component = ?"
+            params = (component,)
+        result = {}
+        with self._lock:
+            for job, comp, phase, run, duration, nbytes in self._db.execute(
+                query + " ORDER BY run, started", params
+            ):
+                result.setdefault((job or "", comp, phase), []).append(
+                    (run, duration, nbytes)
+                )
+        return result
+
+    def failures(self, since):
+        """Returns the number of failed phases per (job, component) since
+        the given time."""
+        with self._lock:
+            return {
+                (job or "", comp): count
+                for job, comp, count in self._db.execute(
+                    "SELECT job, component, COUNT(*) FROM phases "
+                    "WHERE outcome != 'ok' AND started >= ? GROUP BY job, component",
+                    (since,),
+                )
+            }
+
+
+class Run(object):
+    """A run being recorded in the history."""
+
+    def __init__(self, history, id):
+        self.history = history
+        self.id = id
+
+    def finish(self):
+        self.history.finish_run(self.id)
+
+
+class Timer(object):
+    """Times the consecutive phases of one component import, lap timer
+    style: starting a phase ends the previous one as successful.  The
+    current phase also tags the log records and shows in the progress.
+
+    :param run: The Run to record into, or None to only time
+    :param ns: The component namespace
+    :param comp: The component name
+    :param job: The name of the import job, if any
+    """
+
+    def __init__(self, run, ns, comp, job=None):
+        self.run = run
+        self.component = "{}/{}".format(ns, comp)
+        self.job = job
+        self.tracked = (job, ns, comp)
+        self.current = None
+        self.started = None
+        self.bytes = None
+        self.durations = {}
+
+    def phase(self, name):
+        """Ends the current phase successfully and starts a new one."""
+        self._end("ok")
+        self.current = name
+        self.started = time.time()
+        self.bytes = None
+        logsink.phase.set(name)
+        progress.tracker.phase(self.tracked, name)
+
+    def fail(self):
+        """Ends the current phase as failed."""
+        self._end("failed")
+
+    def done(self):
+        """Ends the current phase successfully."""
+        self._end("ok")
+
+    def _end(self, outcome):
+        if self.current is None:
+            return
+        duration = time.time() - self.started
+        self.durations[self.current] = duration
+        if self.run is not None:
+            try:
+                self.run.history.record(
+                    self.run.id,
+                    self.component,
+                    self.current,
+                    self.started,
+                    duration,
+                    self.bytes,
+                    outcome,
+                    self.job,
+                )
+            except Exception:
+                logger.warning("Cannot record run history.", exc_info=True)
+        self.current = None
+
+
+def report(history, components=None, window=10, threshold=1.5, min_seconds=5.0):
+    """Prints the timing trend of each component phase and flags phases
+    whose latest duration regressed against the median of the previous
+    runs.
+
+    :param history: The History to report on
+    :param components: Only report on these components
+    :param window: The number of previous runs forming the baseline
+    :param threshold: The ratio to the baseline that counts as a regression
+    :param min_seconds: Ignore regressions smaller than this many seconds
+    :returns: The list of regressed (job, component, phase) tuples
+    """
+    timings = {}
+    for comp in components or [None]:
+        timings.update(history.timings(comp))
+    regressions = []
+    print(
+        "{:24} {:40} {:10} {:>5} {:>9} {:>9} {:>6}  {}".format(
+            "job", "component", "phase", "runs", "baseline", "latest", "ratio", "trend"
+        )
+    )
+    for (job, comp, phase), samples in sorted(timings.items()):
+        latest = samples[-1][1]
+        previous = [d for _, d, _ in samples[-window - 1 : -1]]
+        baseline = statistics.median(previous) if previous else latest
+        ratio = latest / baseline if baseline else 1.0
+        flag = ""
+        if previous and ratio > threshold and latest - baseline > min_seconds:
+            flag = "  REGRESSION"
+            regressions.append((job, comp, phase))
+        trend = " ".join("{:.0f}".format(d) for _, d, _ in samples[-window:])
+        print(
+            "{:24} {:40} {:10} {:5d} {:8.1f}s {:8.1f}s {:6.2f}  {}{}".format(
+                job, comp, phase, len(samples), baseline, latest, ratio, trend, flag
+            )
+        )
+    failures = history.failures(time.time() - 7 * 86400)
+    for (job, comp), count in sorted(failures.items()):
+        if not components or comp in components:
+            print(
+                "{}: {} failed phase(s) in the last 7 days".format(
+                    "{} ({})".format(comp, job) if job else comp, count
+                )
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report timing trends and regressions of past import runs."
+    )
+    parser.add_argument(
+        "components",
+        nargs="*",
+        help="Only report on these components, as namespace/component",
+    )
+    parser.add_argument("--db", help="The history database", default=default_db)
+    parser.add_argument(
+        "-w",
+        "--window",
+        type=int,
+        help="Number of previous runs forming the baseline",
+        default=10,
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        help="Ratio to the baseline that counts as a regression",
+        default=1.5,
+    )
+
+    args = parser.parse_args()
+
+    regressions = report(History(args.db), args.components, args.window, args.threshold)
+    raise SystemExit(1 if regressions else 0)
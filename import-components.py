@@ -8,39 +8,43 @@ dry_run = None
 # set if using an alternate destination namespace, None to use standard namespace
 alt_ns = "temp"
 
+# git, pyrpkg, regex and lib/distrobaker are slow to import, so they are
+# only imported by the code paths that need them
+
 import argparse
-import git
+import collections.abc
+import concurrent.futures
+import contextlib
+import contextvars
+import json
 import logging
 import os
-import pyrpkg
-import random
-import regex
-import string
+import resource
+import shutil
+import signal
+import subprocess
 import sys
 import tempfile
+import threading
+import time
 
-# path to the lib directory of a checkout of https://github.com/fedora-eln/distrobaker
-sys.path = ["/home/merlinm/github/fedora-eln/distrobaker/lib"] + sys.path
-import distrobaker
-
-from distrobaker import (
-    clone_destination_repo,
-    configure_repo,
-    fetch_upstream_repo,
-    logger,
-    parse_sources,
-    repo_push,
-    split_module,
-    split_scmurl,
-    sync_repo_merge,
-    sync_repo_pull,
-)
+import gitbatch
+import gitremote
+import history
+import logsink
+import lookaside
+import manifest
+import profiling
+import progress
+import repocache
 
 # brute force configuration
 c = {
     "main": {
         "source": {
             "scm": "git://pkgs.devel.redhat.com",
+            # raw single file URL, used to plan without cloning
+            "files": "https://pkgs.devel.redhat.com/cgit/%(ns)s/%(component)s/plain/%(path)s?id=%(ref)s",
             "cache": {
                 "url": "http://pkgs.devel.redhat.com/repo",
                 "cgi": "http://pkgs.devel.redhat.com/lookaside/upload.cgi",
@@ -49,10 +53,18 @@ c = {
         },
         "destination": {
             "scm": "ssh://git@gitlab.com/redhat/centos-stream",
+            # raw single file URL, used to plan without cloning
+            "files": "https://gitlab.com/redhat/centos-stream/%(ns)s/%(component)s/-/raw/%(ref)s/%(path)s",
             "cache": {
                 "url": "https://sources.stream.rdu2.redhat.com/sources",
                 "cgi": "https://sources.stream.rdu2.redhat.com/lookaside/upload.cgi",
                 "path": "%(name)s/%(filename)s/%(hashtype)s/%(hash)s/%(filename)s",
+                # set if upload.cgi (or a proxy in front of it) accepts
+                # uploads in resumable pieces, see lookaside.upload_file()
+                "resumable": False,
+                # how upload.cgi authenticates uploaders, "kerberos" or
+                # None, see lookaside.upload_session()
+                "auth": "kerberos",
             },
         },
         "git": {
@@ -63,6 +75,9 @@ c = {
         "control": {
             "build": "false",
             "merge": "true",
+            # push the source commit as is, without a working tree, when
+            # the destination branch is an ancestor of it
+            "fastforward": True,
             "exclude": {
                 "rpms": {},
                 "modules": {},
@@ -93,19 +108,497 @@ c = {
     },
 }
 
-# copy configurable values into lib/distrobaker
-distrobaker.c = c
+# places to look for the lib directory of a checkout of
+# https://github.com/fedora-eln/distrobaker if it is not importable already;
+# DISTROBAKER_LIB or --distrobaker take precedence
+distrobaker_lib = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "distrobaker", "lib"),
+    os.path.expanduser("~/github/fedora-eln/distrobaker/lib"),
+]
+distrobaker = None
+_distrobaker_lock = threading.Lock()
+
+# same logger lib/distrobaker uses, available before it is loaded
+logger = logging.getLogger("distrobaker")
 
-# extract default value from lib/distrobaker
-retry = distrobaker.retry
+# number of attempts per lookaside file, None for the lib/distrobaker default
+retry = None
 
 repo_base = "/home/merlinm/stream-module-testing/repos/%(component)s"
 
-logging.basicConfig(level=logging.DEBUG)
+# repositories are kept between runs for incremental imports; the least
+# recently used ones are evicted to keep them within this many bytes
+repo_budget = 50 * 1024 ** 3
+repos = repocache.RepoCache(os.path.dirname(repo_base), repo_budget)
+
+# persistent index of lookaside file sizes, used for largest-first scheduling
+size_index = "/home/merlinm/stream-module-testing/cache/sizes.json"
+sizes = lookaside.SizeIndex(size_index)
+
+# last imported source tips in watch mode, and the import events log
+watch_state = "/home/merlinm/stream-module-testing/cache/watch.json"
+watch_events = "/home/merlinm/stream-module-testing/cache/events.jsonl"
+
+# per-component phase timings are recorded here, see history.py
+history_db = history.default_db
+run = None
+
+# verified lookaside files kept between runs, so they are neither
+# downloaded nor hashed again; least recently used ones are pruned to stay
+# within the budget
+content_store = "/home/merlinm/stream-module-testing/cache/content"
+content_budget = 20 * 1024**3
+store = lookaside.ContentStore(content_store, content_budget)
+
+# compiled component list manifests are cached here, see manifest.py
+manifest_dir = "/home/merlinm/stream-module-testing/cache/manifests"
+
+# parsed sources files by git object id, see parse_sources_text()
+sources_index = "/home/merlinm/stream-module-testing/cache/sources.json"
+parsed = lookaside.SourcesIndex(sources_index)
+
+# concurrent destination lookaside existence checks of --audit
+audit_workers = 16
+
+# limits of each component import with --isolate; None means no limit
+worker_limits = {
+    # address space of the worker and each of its git processes, in bytes
+    "memory": 8 * 1024**3,
+    # CPU time of the worker and each of its git processes, in seconds
+    "cpu": 3600,
+    # temporary files of the worker, such as lookaside downloads, in bytes
+    "scratch": 20 * 1024**3,
+    # wall-clock time of the whole import, in seconds
+    "deadline": 4 * 3600,
+}
+# the directory isolated workers get their scratch directories in, None
+# for the system temporary directory
+scratch_root = None
+
+# pushes run on their own pool, see PushQueue
+push_workers = 2
+
+# lookaside transfers run on a shared pool, largest file first
+transfer_workers = 4
+scheduler = lookaside.TransferScheduler(transfer_workers)
+
+# structured per-component logs, one directory per run
+log_dir = "/home/merlinm/stream-module-testing/logs"
+
+# set to a directory to capture cProfile data of each component import
+profile_dir = None
+
+
+class Job(object):
+    """The configuration of one import job.  Everything that differs
+    between import configurations is carried here and passed down to the
+    functions doing the work, so that jobs with different configurations
+    can run concurrently in one process.
+
+    :param c: The configuration, in the lib/distrobaker format
+    :param dry_run: Do not upload or push
+    :param alt_ns: An alternate destination namespace, None to use the
+    standard namespace
+    :param resync_cache_only: Only synchronize the lookaside cache of the
+    destination sources, do not push
+    :param repo_base: The repository directory template
+    :param name: A name for the job, used in logs and state keys
+    """
+
+    def __init__(
+        self,
+        c,
+        dry_run=False,
+        alt_ns=None,
+        resync_cache_only=False,
+        repo_base=repo_base,
+        name=None,
+    ):
+        self.c = c
+        self.dry_run = dry_run
+        self.alt_ns = alt_ns
+        self.resync_cache_only = resync_cache_only
+        self.repo_base = repo_base
+        self.name = name
+
+
+def default_job():
+    """Returns a job using the module level configuration."""
+    return Job(
+        c,
+        dry_run=dry_run,
+        alt_ns=alt_ns,
+        resync_cache_only=resync_cache_only,
+        repo_base=repo_base,
+    )
+
+
+# the job being imported by the current task, see import_component(); a
+# context variable, so it follows the work onto transfer and push threads
+_current = contextvars.ContextVar("job", default=None)
+
+
+def current_job():
+    """Returns the job the calling task works on."""
+    job = _current.get()
+    return job if job is not None else default_job()
+
+
+class PushQueue(object):
+    """Runs the pushes of imported components on their own worker
+    threads, so that import workers can move on to the next component
+    while the previous one is being pushed.  Results are kept in
+    submission order.
+
+    :param workers: The number of concurrent pushes
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pushes = []
+
+    def submit(self, key, fn):
+        """Queues a push.
+
+        :param key: The component, as namespace/component
+        :param fn: The callable doing the push, run in a copy of the
+        context of the caller
+        :returns: A concurrent.futures.Future for the result of fn
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="push"
+                )
+            future = self._executor.submit(contextvars.copy_context().run, fn)
+            self._pushes.append((key, future))
+        return future
+
+    def results(self):
+        """Waits for the queued pushes and returns their results in
+        submission order, as (component, destination scm dict or None)
+        tuples."""
+        with self._lock:
+            pushes = list(self._pushes)
+        results = []
+        for key, future in pushes:
+            try:
+                results.append((key, future.result()))
+            except Exception:
+                logger.error("Unexpected error pushing %s.", key, exc_info=True)
+                results.append((key, None))
+        return results
+
+    def shutdown(self):
+        """Waits for the queued pushes and stops the workers."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    @staticmethod
+    def outcome(result):
+        """Returns the final result of import_component(), waiting for the
+        push if it was handed to a PushQueue; None if the push raised."""
+        if isinstance(result, concurrent.futures.Future):
+            try:
+                return result.result()
+            except Exception:
+                return None
+        return result
+
+
+class _CurrentConfig(collections.abc.Mapping):
+    """Stands in for the configuration global of lib/distrobaker and
+    resolves to the configuration of the job of the calling thread."""
+
+    def __getitem__(self, key):
+        return current_job().c[key]
+
+    def __iter__(self):
+        return iter(current_job().c)
+
+    def __len__(self):
+        return len(current_job().c)
+
+
+class _CurrentDryRun(object):
+    """Stands in for the dry_run global of lib/distrobaker and resolves to
+    the setting of the job of the calling thread."""
+
+    def __bool__(self):
+        return bool(current_job().dry_run)
+
+
+def load_distrobaker():
+    """Imports lib/distrobaker on first use and copies the configurable
+    values into it.
+
+    :returns: The distrobaker module
+    :raises ImportError: If distrobaker cannot be found
+    """
+    global distrobaker
+    with _distrobaker_lock:
+        if distrobaker is not None:
+            return distrobaker
+        paths = distrobaker_lib
+        if os.environ.get("DISTROBAKER_LIB"):
+            paths = [os.environ["DISTROBAKER_LIB"]] + paths
+        for path in paths:
+            if os.path.isfile(os.path.join(path, "distrobaker.py")):
+                sys.path.insert(0, os.path.abspath(path))
+                break
+        try:
+            import distrobaker as db
+        except ImportError:
+            raise ImportError(
+                "Cannot find lib/distrobaker, set DISTROBAKER_LIB to the lib "
+                "directory of a distrobaker checkout (tried {}).".format(
+                    ", ".join(paths)
+                )
+            )
+        # point the configurable values of lib/distrobaker at the job of
+        # the calling thread
+        db.c = _CurrentConfig()
+        db.dry_run = _CurrentDryRun()
+        distrobaker = db
+        return distrobaker
+
+
+# split_scmurl() and split_module() from lib/distrobaker, so that resolving
+# components does not need to load it
+def split_scmurl(scmurl):
+    """Splits a `link#ref` style URLs into the link and ref parts.  The
+    component name and namespace are extracted from the link as well.
+
+    :param scmurl: A `link#ref` style URL, with #ref being optional
+    :returns: A dictionary with `link`, `ns`, `comp` and `ref` keys
+    """
+    scm = scmurl.split("#", 1)
+    nscm = scm[0].split("/")
+    return {
+        "link": scm[0],
+        "ns": nscm[-2] if len(nscm) >= 2 else None,
+        "comp": nscm[-1][:-4] if nscm[-1].endswith(".git") else nscm[-1],
+        "ref": scm[1] if len(scm) >= 2 else None,
+    }
+
+
+def split_module(comp):
+    """Splits a module component name in the `name:stream` format into
+    its name and stream, defaulting the stream to master.
+
+    :param comp: The module component name
+    :returns: A dictionary with `name` and `stream` keys
+    """
+    ms = comp.split(":")
+    return {
+        "name": ms[0],
+        "stream": ms[1] if len(ms) > 1 and ms[1] else "master",
+    }
+
+# sources file regular expression, as used by parse_sources()
+SRCRE = r"^(?P<hash>[a-f0-9]{32})  (?P<file>.+)$|^(?P<hashtype>[A-Za-z0-9]+) \((?P<file>.+)\) = (?P<hash>[a-f0-9]+)$"
+
+
+def parse_sources_text(comp, ns, text, oid=None):
+    """Parses the content of a sources file the same way parse_sources()
+    parses a sources file on disk.  Parsed files are remembered by their
+    git object id in the sources index, so the same file is only parsed
+    once, across components, streams and runs.
+
+    :param comp: The component we are parsing
+    :param ns: The namespace of the component
+    :param text: The sources file content, or None if there is no file
+    :param oid: The git object id of the file, computed from the content
+    if not given
+    :returns: A set of (filename, hash, hashtype) tuples, or None on error
+    """
+    src = set()
+    if text is None:
+        logger.debug("No sources file found for %s/%s.", ns, comp)
+        return src
+    if oid is None:
+        oid = gitbatch.hash_blob(text.encode("utf-8"))
+    cached = parsed.get(oid)
+    if cached is not None:
+        return cached
+
+    import regex
+
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        m = regex.match(SRCRE, line.rstrip())
+        if m is None:
+            logger.error(
+                "Cannot parse line %s of %s/%s sources file, aborting.",
+                line,
+                ns,
+                comp,
+            )
+            return None
+        m = m.groupdict()
+        src.add(
+            (
+                m["file"],
+                m["hash"],
+                "md5" if m["hashtype"] is None else m["hashtype"].lower(),
+            )
+        )
+    parsed.set(oid, src)
+    return src
+
+
+def cache_names(ns, comp, job):
+    """Returns the source and destination lookaside cache names of a
+    component."""
+    if comp in job.c["comps"][ns]:
+        scname = job.c["comps"][ns][comp]["cache"]["source"]
+        dcname = job.c["comps"][ns][comp]["cache"]["destination"]
+    else:
+        scname = job.c["main"]["defaults"]["cache"]["source"] % {"component": comp}
+        dcname = job.c["main"]["defaults"]["cache"]["source"] % {"component": comp}
+    return scname, dcname
+
+
+def resolve_component(bscm, job):
+    """Resolves the source and destination of a component from the
+    configuration.
+
+    :param bscm: The split scmurl of the component to import
+    :param job: The import job
+    :returns: A dict with the ns, comp, ref, cname and sname of the
+    component, its split source and destination scmurls as sscm and dscm,
+    and its repository directory as gitdir
+    """
+    ns = bscm["ns"]
+    comp = bscm["comp"]
+    ref = bscm["ref"]
+
+    if ns == "modules":
+        ms = split_module(comp)
+        cname = ms["name"]
+        sname = ms["stream"]
+    else:
+        cname = comp
+        sname = ""
+
+    if comp in job.c["comps"][ns]:
+        csrc = job.c["comps"][ns][comp]["source"]
+        cdst = job.c["comps"][ns][comp]["destination"]
+    else:
+        csrc = job.c["main"]["defaults"][ns]["source"]
+        cdst = job.c["main"]["defaults"][ns]["destination"]
+
+    # append #ref if not already present
+    if "#" not in csrc:
+        csrc += "#%(ref)s"
+    if "#" not in cdst:
+        cdst += "#%(ref)s"
+
+    csrc = csrc % {
+        "component": cname,
+        "stream": sname,
+        "ref": ref,
+    }
+    cdst = cdst % {
+        "component": cname,
+        "stream": sname,
+        "ref": ref,
+    }
+    sscm = split_scmurl("{}/{}/{}".format(job.c["main"]["source"]["scm"], ns, csrc))
+    dscm = split_scmurl(
+        "{}/{}/{}".format(
+            job.c["main"]["destination"]["scm"], job.alt_ns if job.alt_ns else ns, cdst
+        )
+    )
+    dscm["ref"] = dscm["ref"] if dscm["ref"] else "master"
+
+    gitdir = job.repo_base % {
+        "component": cname,
+        "stream": sname,
+        "ref": ref,
+    }
+    return {
+        "ns": ns,
+        "comp": comp,
+        "ref": ref,
+        "cname": cname,
+        "sname": sname,
+        "sscm": sscm,
+        "dscm": dscm,
+        "gitdir": gitdir,
+    }
+
+
+def resolve_entry(rec, job):
+    """Resolves a component argument or list entry for a manifest, see
+    manifest.py.
+
+    :param rec: The component, as namespace/component#ref or a full link
+    :param job: The import job
+    :returns: The resolved component, as returned by resolve_component(),
+    with its source and destination cache names added as scname and dcname
+    :raises ValueError: If the namespace is unknown
+    """
+    bscm = split_scmurl(rec)
+    if bscm["ns"] not in job.c["comps"]:
+        raise ValueError("unknown namespace {}".format(bscm["ns"]))
+    rc = resolve_component(bscm, job)
+    rc["scname"], rc["dcname"] = cache_names(rc["ns"], rc["comp"], job)
+    return rc
+
+
+def load_manifest(recs, paths, job):
+    """Resolves the components given as arguments and in component list
+    files into one deduplicated manifest.  The manifests of list files are
+    cached in manifest_dir.
+
+    :param recs: The component arguments
+    :param paths: The component list files
+    :param job: The import job
+    :returns: The manifest.Manifest
+    :raises ValueError: If an entry cannot be resolved
+    """
+
+    def resolve(rec):
+        return resolve_entry(rec, job)
+
+    listed = manifest.Manifest([])
+    if paths:
+        listed = manifest.load(
+            paths,
+            {"c": job.c, "alt_ns": job.alt_ns, "repo_base": job.repo_base},
+            resolve,
+            manifest_dir,
+        )
+    given = manifest.Manifest.compile(recs, resolve)
+    seen = {(e["ns"], e["comp"], e["ref"]) for e in listed.entries}
+    entries = list(listed.entries)
+    duplicates = listed.duplicates + given.duplicates
+    for entry in given.entries:
+        if (entry["ns"], entry["comp"], entry["ref"]) in seen:
+            duplicates += 1
+        else:
+            entries.append(entry)
+    return manifest.Manifest(entries, duplicates)
+
 
 # revised sync_cache() from lib/distrobaker that allows an alternate
 # destination namespace to be specified
-def sync_cache(comp, sources, ns="rpms", dns=None, scacheurl=None):
+def sync_cache(
+    comp,
+    sources,
+    ns="rpms",
+    dns=None,
+    scacheurl=None,
+    stats=None,
+    job=None,
+    origin=None,
+):
     """Synchronizes lookaside cache contents for the given component.
     Expects a set of (filename, hash, hastype) tuples to synchronize, as
     returned by parse_sources().
@@ -117,72 +610,188 @@ def sync_cache(comp, sources, ns="rpms", dns=None, scacheurl=None):
     defaults to value of 'ns'
     :param scacheurl: Optional source lookaside cache url for modular RPM
     components
+    :param stats: Optional dict, receives the number of bytes transferred
+    as "bytes"
+    :param job: The import job, defaults to the one of the calling thread
+    :param origin: Copy the files from this namespace of the destination
+    cache instead of the source cache, see source_cache()
     :returns: The number of files processed, or None on error
     """
+    job = job if job else current_job()
     dns = dns if dns else ns
-    if "main" not in c:
+    if "main" not in job.c:
         logger.critical("DistroBaker is not configured, aborting.")
         return None
-    if comp in c["main"]["control"]["exclude"][ns]:
+    if comp in job.c["main"]["control"]["exclude"][ns]:
         logger.critical(
             "The component %s/%s is excluded from sync, aborting.", ns, comp
         )
         return None
     logger.debug("Synchronizing %d cache file(s) for %s/%s.", len(sources), ns, comp)
     if scacheurl:
-        if scacheurl != c["main"]["source"]["cache"]["url"]:
+        if scacheurl != job.c["main"]["source"]["cache"]["url"]:
             logger.warning(
                 "The custom source lookaside cache URL for %s/%s (%s) doesn't "
                 "match configuration (%s), ignoring.",
                 ns,
                 comp,
                 scacheurl,
-                c["main"]["source"]["cache"]["url"],
+                job.c["main"]["source"]["cache"]["url"],
             )
-    scache = pyrpkg.lookaside.CGILookasideCache(
+    scname, dcname = cache_names(ns, comp, job)
+    scache, sname = source_cache(ns, scname, dcname, job, origin)
+    tempdir = tempfile.TemporaryDirectory(prefix="cache-{}-{}-".format(ns, comp))
+    logger.debug("Temporary directory created: %s", tempdir.name)
+    total = 0
+    expected = {}
+    futures = {}
+    for s in sources:
+        size = sizes.get("{}/{}".format(ns, scname), s[0], s[1])
+        if size is None:
+            size = lookaside.remote_file_size(scache, sname, s[0], s[1], s[2])
+            if size is not None:
+                sizes.set("{}/{}".format(ns, scname), s[0], s[1], size)
+        total += size or 0
+        expected[s] = size or 0
+        futures[s] = scheduler.submit(
+            size,
+            sync_cache_file,
+            comp,
+            s,
+            ns,
+            dns,
+            scname,
+            dcname,
+            tempdir.name,
+            job,
+            origin,
+        )
+    progress.tracker.transfer_queued(total)
+    logger.debug(
+        "Queued %d cache file(s) (%d bytes) for %s/%s.", len(sources), total, ns, comp
+    )
+    failed = False
+    transferred = 0
+    for s, future in futures.items():
+        try:
+            result = future.result()
+            if result is None:
+                failed = True
+            else:
+                transferred += result
+        except Exception:
+            logger.error(
+                "Unexpected error handling %s for %s/%s.",
+                s[0],
+                ns,
+                comp,
+                exc_info=True,
+            )
+            failed = True
+        progress.tracker.transfer_done(expected[s])
+    tempdir.cleanup()
+    try:
+        sizes.save()
+    except Exception:
+        logger.warning("Cannot save size index %s.", size_index, exc_info=True)
+    if stats is not None:
+        stats["bytes"] = transferred
+    if failed:
+        return None
+    return len(sources)
+
+
+def source_cache(ns, scname, dcname, job, origin=None):
+    """Returns the lookaside cache the files of a component are copied
+    from, and the name of the component in it.  That is the source cache,
+    or with an origin, the destination cache under another namespace, as
+    when promoting from the alternate namespace.
+
+    :param ns: The component namespace
+    :param scname: The source cache name of the component
+    :param dcname: The destination cache name of the component
+    :param job: The import job
+    :param origin: The namespace of the destination cache to copy from, or
+    None to use the source cache
+    :returns: A (CGILookasideCache, name) tuple
+    """
+    import pyrpkg
+
+    side = "destination" if origin else "source"
+    cache = pyrpkg.lookaside.CGILookasideCache(
         "sha512",
-        c["main"]["source"]["cache"]["url"],
-        c["main"]["source"]["cache"]["cgi"],
+        job.c["main"][side]["cache"]["url"],
+        job.c["main"][side]["cache"]["cgi"],
     )
-    scache.download_path = c["main"]["source"]["cache"]["path"]
+    cache.download_path = job.c["main"][side]["cache"]["path"]
+    if origin:
+        return cache, "{}/{}".format(origin, dcname)
+    return cache, "{}/{}".format(ns, scname)
+
+
+def sync_cache_file(comp, s, ns, dns, scname, dcname, tempdir, job, origin=None):
+    """Synchronizes a single lookaside cache file, retrying on failure.
+    Runs on a scheduler worker thread, so it uses its own lookaside cache
+    instances.
+
+    :param comp: The component name
+    :param s: The (filename, hash, hashtype) source tuple
+    :param ns: The component namespace
+    :param dns: The destination namespace
+    :param scname: The source cache name of the component
+    :param dcname: The destination cache name of the component
+    :param tempdir: The directory to download into
+    :param job: The import job
+    :param origin: The namespace of the destination cache to copy from, or
+    None to download from the source cache
+    :returns: The number of bytes transferred, or None if all attempts failed
+    """
+    import pyrpkg
+
+    attempts = retry if retry else load_distrobaker().retry
+    scache, sname = source_cache(ns, scname, dcname, job, origin)
     dcache = pyrpkg.lookaside.CGILookasideCache(
         "sha512",
-        c["main"]["destination"]["cache"]["url"],
-        c["main"]["destination"]["cache"]["cgi"],
+        job.c["main"]["destination"]["cache"]["url"],
+        job.c["main"]["destination"]["cache"]["cgi"],
     )
-    dcache.download_path = c["main"]["destination"]["cache"]["path"]
-    tempdir = tempfile.TemporaryDirectory(prefix="cache-{}-{}-".format(ns, comp))
-    logger.debug("Temporary directory created: %s", tempdir.name)
-    if comp in c["comps"][ns]:
-        scname = c["comps"][ns][comp]["cache"]["source"]
-        dcname = c["comps"][ns][comp]["cache"]["destination"]
-    else:
-        scname = c["main"]["defaults"]["cache"]["source"] % {"component": comp}
-        dcname = c["main"]["defaults"]["cache"]["source"] % {"component": comp}
-    for s in sources:
-        # There's no API for this and .upload doesn't let us override it
-        dcache.hashtype = s[2]
-        for attempt in range(retry):
-            try:
-                if not dcache.remote_file_exists(
-                    "{}/{}".format(dns, dcname), s[0], s[1]
-                ):
+    dcache.download_path = job.c["main"]["destination"]["cache"]["path"]
+    # There's no API for this and .upload doesn't let us override it
+    dcache.hashtype = s[2]
+    for attempt in range(attempts):
+        transferred = 0
+        try:
+            if not dcache.remote_file_exists("{}/{}".format(dns, dcname), s[0], s[1]):
+                logger.debug(
+                    "File %s for %s/%s (%s/%s) not available in the "
+                    "destination cache, downloading.",
+                    s[0],
+                    ns,
+                    comp,
+                    dns,
+                    dcname,
+                )
+                path = store.get(s[0], s[1], s[2])
+                if path is not None:
                     logger.debug(
-                        "File %s for %s/%s (%s/%s) not available in the "
-                        "destination cache, downloading.",
+                        "File %s for %s/%s found in the content store.",
                         s[0],
                         ns,
                         comp,
-                        dns,
-                        dcname,
                     )
-                    scache.download(
-                        "{}/{}".format(ns, scname),
+                else:
+                    # the hash is verified while downloading, so the file
+                    # is only read again to upload it
+                    lookaside.download_file(
+                        scache,
+                        sname,
                         s[0],
                         s[1],
-                        os.path.join(tempdir.name, s[0]),
-                        hashtype=s[2],
+                        s[2],
+                        os.path.join(tempdir, s[0]),
+                        attempts=1,
                     )
+                    path = store.put(os.path.join(tempdir, s[0]), s[0], s[1], s[2])
                     logger.debug(
                         "File %s for %s/%s (%s/%s) successfully downloaded.  "
                         "Uploading to the destination cache.",
@@ -192,202 +801,1282 @@ def sync_cache(comp, sources, ns="rpms", dns=None, scacheurl=None):
                         ns,
                         scname,
                     )
-                    if not dry_run:
-                        dcache.upload(
-                            "{}/{}".format(dns, dcname),
-                            os.path.join(tempdir.name, s[0]),
-                            s[1],
-                        )
-                        logger.debug(
-                            "File %s for %s/%s (%s/%s) )successfully uploaded "
-                            "to the destination cache.",
-                            s[0],
-                            ns,
-                            comp,
-                            dns,
-                            dcname,
-                        )
-                    else:
-                        logger.debug(
-                            "Running in dry run mode, not uploading %s for %s/%s (%s/%s).",
-                            s[0],
-                            ns,
-                            comp,
-                            dns,
-                            dcname,
-                        )
+                transferred = os.path.getsize(path)
+                if sizes.get("{}/{}".format(ns, scname), s[0], s[1]) is None:
+                    sizes.set("{}/{}".format(ns, scname), s[0], s[1], transferred)
+                if not job.dry_run:
+                    lookaside.upload_file(
+                        dcache,
+                        "{}/{}".format(dns, dcname),
+                        path,
+                        s[1],
+                        s[2],
+                        resumable=job.c["main"]["destination"]["cache"].get(
+                            "resumable", False
+                        ),
+                        auth=job.c["main"]["destination"]["cache"].get(
+                            "auth", "kerberos"
+                        ),
+                    )
+                    logger.debug(
+                        "File %s for %s/%s (%s/%s) )successfully uploaded "
+                        "to the destination cache.",
+                        s[0],
+                        ns,
+                        comp,
+                        dns,
+                        dcname,
+                    )
                 else:
                     logger.debug(
-                        "File %s for %s/%s (%s/%s) already uploaded, skipping.",
+                        "Running in dry run mode, not uploading %s for %s/%s (%s/%s).",
                         s[0],
                         ns,
                         comp,
                         dns,
                         dcname,
                     )
-            except Exception:
-                logger.warning(
-                    "Failed attempt #%d/%d handling %s for %s/%s (%s/%s -> %s/%s), retrying.",
-                    attempt + 1,
-                    retry,
+                if os.path.exists(os.path.join(tempdir, s[0])):
+                    os.unlink(os.path.join(tempdir, s[0]))
+            else:
+                logger.debug(
+                    "File %s for %s/%s (%s/%s) already uploaded, skipping.",
                     s[0],
                     ns,
                     comp,
-                    ns,
-                    scname,
                     dns,
                     dcname,
-                    exc_info=True,
                 )
-            else:
-                break
-        else:
-            logger.error(
-                "Exhausted lookaside cache synchronization attempts for %s/%s "
-                "while working on %s, skipping.",
+        except Exception:
+            logger.warning(
+                "Failed attempt #%d/%d handling %s for %s/%s (%s/%s -> %s/%s), retrying.",
+                attempt + 1,
+                attempts,
+                s[0],
                 ns,
                 comp,
-                s[0],
+                ns,
+                scname,
+                dns,
+                dcname,
+                exc_info=True,
             )
-            return None
-    return len(sources)
-
-
-def import_component(bscm):
-    ns = bscm["ns"]
-    comp = bscm["comp"]
-    ref = bscm["ref"]
+        else:
+            return transferred
+    logger.error(
+        "Exhausted lookaside cache synchronization attempts for %s/%s "
+        "while working on %s, skipping.",
+        ns,
+        comp,
+        s[0],
+    )
+    return None
 
-    logger.info("Importing %s/%s#%s.", ns, comp, ref)
 
-    if ns == "modules":
-        ms = split_module(comp)
-        cname = ms["name"]
-        sname = ms["stream"]
-    else:
-        cname = comp
-        sname = ""
+def import_component(bscm, job=None, pushes=None, rc=None):
+    """Imports a single component into the destination namespace.
 
-    if comp in c["comps"][ns]:
-        csrc = c["comps"][ns][comp]["source"]
-        cdst = c["comps"][ns][comp]["destination"]
-    else:
-        csrc = c["main"]["defaults"][ns]["source"]
-        cdst = c["main"]["defaults"][ns]["destination"]
+    If a PushQueue is given, the push is handed to it and the repository
+    stays in use until the push is done, but the function returns as soon
+    as the component is ready to be pushed.
 
-    # append #ref if not already present
-    if "#" not in csrc:
-        csrc += "#%(ref)s"
-    if "#" not in cdst:
-        cdst += "#%(ref)s"
+    :param bscm: The split scmurl of the component to import
+    :param job: The import job, defaults to the module level configuration
+    :param pushes: An optional PushQueue to push on
+    :param rc: The component resolved for the job, such as a manifest
+    entry; resolved here if not given
+    :returns: The destination scm dict, with the imported commit hash added
+    as "commit", or None on error; with pushes, a Future of it instead,
+    unless it failed before the push
+    """
+    job = job if job else default_job()
+    rc = rc if rc else resolve_component(bscm, job)
+    ns = rc["ns"]
+    comp = rc["comp"]
+    sscm = rc["sscm"]
+    dscm = rc["dscm"]
+    gitdir = rc["gitdir"]
 
-    csrc = csrc % {
-        "component": cname,
-        "stream": sname,
-        "ref": ref,
-    }
-    cdst = cdst % {
-        "component": cname,
-        "stream": sname,
-        "ref": ref,
-    }
-    sscm = split_scmurl("{}/{}/{}".format(c["main"]["source"]["scm"], ns, csrc))
-    dscm = split_scmurl(
-        "{}/{}/{}".format(
-            c["main"]["destination"]["scm"], alt_ns if alt_ns else ns, cdst
-        )
-    )
-    dscm["ref"] = dscm["ref"] if dscm["ref"] else "master"
+    logger.info("Importing %s/%s#%s.", ns, comp, rc["ref"])
     logger.debug("source scm = %s", sscm)
     logger.debug("destination scm = %s", dscm)
-
-    gitdir = repo_base % {
-        "component": cname,
-        "stream": sname,
-        "ref": ref,
-    }
     logger.debug("repo directory = %s", gitdir)
 
-    # clone desination repo
-    repo = clone_destination_repo(ns, comp, dscm, gitdir)
-    if repo is None:
-        logger.error("Failed to clone destination repo for %s/%s, skipping.", ns, comp)
-        return None
+    token = _current.set(job)
+    key = "{}/{}".format(ns, comp)
+    tracked = (job.name, ns, comp)
+    progress.tracker.start(tracked)
+    result = None
+    try:
+        with logsink.tagged(key, job.name), profiling.component_profile(
+            profile_dir, key
+        ), contextlib.ExitStack() as stack:
+            stack.enter_context(repos.use(gitdir))
+            stack.callback(gitbatch.release, gitdir)
+            push = sync_component(rc, bscm, job)
+            if push is None:
+                return None
+            if pushes is None:
+                result = push()
+                return result
+            # the push worker takes over the repository
+            held = stack.pop_all()
 
-    if fetch_upstream_repo(ns, comp, sscm, repo) is None:
-        logger.error("Failed to fetch upstream repo for %s/%s, skipping.", ns, comp)
+            def pushed():
+                with held:
+                    dscm = push()
+                progress.tracker.finish(tracked, dscm is not None)
+                return dscm
+
+            result = pushes.submit(key, pushed)
+            return result
+    finally:
+        if not isinstance(result, concurrent.futures.Future):
+            progress.tracker.finish(tracked, result is not None)
+        _current.reset(token)
+
+
+def import_group(entries, job, pushes=None):
+    """Imports components sharing a repository directory one after the
+    other, so that a single worker reuses the repository instead of
+    several waiting for it.
+
+    :param entries: The manifest entries of the components
+    :param job: The import job
+    :param pushes: An optional PushQueue to push on
+    :returns: The list of results of import_component(), in order
+    """
+    results = []
+    for entry in entries:
+        try:
+            results.append(
+                import_component(split_scmurl(entry["rec"]), job, pushes, entry)
+            )
+        except Exception:
+            logger.error(
+                "Unexpected error importing %s/%s.",
+                entry["ns"],
+                entry["comp"],
+                exc_info=True,
+            )
+            results.append(None)
+    return results
+
+
+def open_destination_repo(ns, comp, sscm, dscm, gitdir):
+    """Opens the destination repository kept from an earlier run and
+    resets it to the destination branch, or clones it if there is none.
+    If the destination branch does not exist yet, it is created at the
+    source ref.
+
+    :param ns: The component namespace
+    :param comp: The component name
+    :param sscm: The split source scmurl
+    :param dscm: The split destination scmurl
+    :param gitdir: The repository directory
+    :returns: The git.Repo object, or None on error
+    """
+    import git
+
+    if os.path.isdir(os.path.join(gitdir, ".git")):
+        logger.debug("Reusing repository %s for %s/%s.", gitdir, ns, comp)
+        try:
+            repo = git.Repo(gitdir)
+            if "source" in [r.name for r in repo.remotes]:
+                repo.delete_remote("source")
+            repo.git.remote("set-url", "origin", dscm["link"])
+            repo.git.fetch("--prune", "origin")
+            start = "origin/{}".format(dscm["ref"])
+            if start not in [r.name for r in repo.remotes.origin.refs]:
+                logger.info(
+                    "Branch %s of %s/%s does not exist yet, creating it.",
+                    dscm["ref"],
+                    ns,
+                    comp,
+                )
+                repo.git.fetch("--no-tags", sscm["link"], sscm["ref"])
+                start = "FETCH_HEAD"
+            repo.git.checkout("--force", "-B", dscm["ref"], start)
+            repo.git.clean("-ffdx")
+            return repo
+        except Exception:
+            logger.warning(
+                "Cannot reuse repository %s for %s/%s, cloning it again.",
+                gitdir,
+                ns,
+                comp,
+                exc_info=True,
+            )
+            gitbatch.release(gitdir)
+            shutil.rmtree(gitdir, ignore_errors=True)
+    return load_distrobaker().clone_destination_repo(ns, comp, dscm, gitdir)
+
+
+def sync_component(rc, bscm, job):
+    """Synchronizes a resolved component in its repository directory, up
+    to the push.  Called by import_component() while the repository is in
+    use.
+
+    :param rc: The resolved component, as returned by resolve_component()
+    :param bscm: The split scmurl of the component to import
+    :param job: The import job
+    :returns: A callable doing the push, to be called while the repository
+    is still in use, which returns the destination scm dict with the
+    imported commit hash added as "commit", or None on error; or None on
+    error
+    """
+    ns = rc["ns"]
+    comp = rc["comp"]
+    sscm = rc["sscm"]
+    dscm = rc["dscm"]
+    db = load_distrobaker()
+    timer = history.Timer(run, ns, comp, job.name)
+
+    if job.c["main"]["control"].get("fastforward"):
+        timer.phase("fetch")
+        tips = fast_forward_tips(rc)
+        if tips is not None:
+            return sync_fast_forward(rc, tips[0], tips[1], job, timer)
+
+    # clone desination repo, or reuse the one from the last run
+    timer.phase("clone")
+    repo = open_destination_repo(ns, comp, sscm, dscm, rc["gitdir"])
+    if repo is None:
+        logger.error("Failed to clone destination repo for %s/%s, skipping.", ns, comp)
+        timer.fail()
+        return None
+
+    timer.phase("fetch")
+    if db.fetch_upstream_repo(ns, comp, sscm, repo) is None:
+        logger.error("Failed to fetch upstream repo for %s/%s, skipping.", ns, comp)
+        timer.fail()
         return None
 
-    if configure_repo(ns, comp, repo) is None:
+    timer.phase("configure")
+    if db.configure_repo(ns, comp, repo) is None:
         logger.error(
             "Failed to configure the git repository for %s/%s, skipping.",
             ns,
             comp,
         )
+        timer.fail()
         return None
 
     logger.debug("Gathering destination files for %s/%s.", ns, comp)
 
-    dsrc = parse_sources(comp, ns, os.path.join(repo.working_dir, "sources"))
+    # sources are read from the object store, no need to look at the
+    # working tree
+    batch = gitbatch.engine(rc["gitdir"])
+    dsrc = read_local_sources(batch, "HEAD", ns, comp)
     if dsrc is None:
         logger.error(
             "Error processing the %s/%s destination sources file, skipping.",
             ns,
             comp,
         )
+        timer.fail()
         return None
 
-    if c["main"]["control"]["merge"]:
-        if sync_repo_merge(ns, comp, repo, bscm, sscm, dscm) is None:
+    timer.phase("merge")
+    if job.c["main"]["control"]["merge"]:
+        if db.sync_repo_merge(ns, comp, repo, bscm, sscm, dscm) is None:
             logger.error("Failed to sync merge repo for %s/%s, skipping.", ns, comp)
+            timer.fail()
             return None
     else:
-        if sync_repo_pull(ns, comp, repo, bscm) is None:
+        if db.sync_repo_pull(ns, comp, repo, bscm) is None:
             logger.error("Failed to sync pull repo for %s/%s, skipping.", ns, comp)
+            timer.fail()
             return None
 
     logger.debug("Gathering source files for %s/%s.", ns, comp)
-    ssrc = parse_sources(comp, ns, os.path.join(repo.working_dir, "sources"))
+    ssrc = read_local_sources(batch, "HEAD", ns, comp)
     if ssrc is None:
         logger.error(
             "Error processing the %s/%s source sources file, skipping.",
             ns,
             comp,
         )
+        timer.fail()
         return None
 
-    if resync_cache_only:
+    if not sync_lookaside(rc, ssrc, dsrc, job, timer):
+        return None
+
+    logger.debug("Component %s/%s successfully synchronized.", ns, comp)
+
+    def push():
+        if not job.resync_cache_only:
+            timer.phase("push")
+            if db.repo_push(ns, comp, repo, dscm) is None:
+                logger.error("Failed to push %s/%s, skipping.", ns, comp)
+                timer.fail()
+                return None
+        else:
+            logger.info(
+                "Re-syncing cache only; not attempting to push repo for %s/%s.",
+                ns,
+                comp,
+            )
+        timer.done()
+
+        logger.info("Successfully synchronized %s/%s.", ns, comp)
+        dscm["commit"] = repo.head.commit.hexsha
+        return dscm
+
+    return push
+
+
+def sync_lookaside(rc, ssrc, dsrc, job, timer):
+    """Synchronizes the lookaside cache files the source adds over the
+    destination, or all destination files when only re-syncing the cache.
+
+    :param rc: The resolved component, as returned by resolve_component()
+    :param ssrc: The parsed source sources file
+    :param dsrc: The parsed destination sources file
+    :param job: The import job
+    :param timer: The history.Timer of the import
+    :returns: True on success, False on error
+    """
+    ns = rc["ns"]
+    comp = rc["comp"]
+    if job.resync_cache_only:
         srcdiff = dsrc
     else:
         srcdiff = ssrc - dsrc
+    timer.phase("lookaside")
     if srcdiff:
         logger.debug("Source files for %s/%s differ.", ns, comp)
-        if sync_cache(comp, srcdiff, ns, dns=alt_ns) is None:
+        stats = {}
+        if (
+            sync_cache(comp, srcdiff, ns, dns=job.alt_ns, stats=stats, job=job)
+            is None
+        ):
             logger.error("Failed to synchronize sources for %s/%s, skipping.", ns, comp)
-            return None
+            timer.fail()
+            return False
+        timer.bytes = stats["bytes"]
     else:
         logger.debug("Source files for %s/%s are up-to-date.", ns, comp)
+    record_component_total(ns, comp, ssrc, job)
+    return True
+
+
+def record_component_total(ns, comp, sources, job):
+    """Records the total size of all source files of a component, not only
+    of those an import transferred, for largest-first scheduling of later
+    runs.  Files of unknown size are not counted.
+
+    :param ns: The component namespace
+    :param comp: The component name
+    :param sources: The set of source tuples of the component
+    :param job: The import job
+    """
+    scname, _ = cache_names(ns, comp, job)
+    total = sum(sizes.get("{}/{}".format(ns, scname), s[0], s[1]) or 0 for s in sources)
+    if total == sizes.component_total(ns, comp):
+        return
+    sizes.set_component_total(ns, comp, total)
+    try:
+        sizes.save()
+    except Exception:
+        logger.warning("Cannot save size index %s.", size_index, exc_info=True)
+
+
+def fast_forward_tips(rc):
+    """Fetches the destination branch and the source ref into the
+    repository directory, without touching a working tree, and checks
+    whether the destination can be fast-forwarded to the source.  A
+    repository is initialized if there is none yet.
+
+    :param rc: The resolved component, as returned by resolve_component()
+    :returns: A (destination commit, source commit) tuple if the
+    destination branch exists and is the source commit or an ancestor of
+    it, None otherwise
+    """
+    tips = _fast_forward_tips(rc)
+    if tips is None:
+        # the slow path may replace the repository, do not let it read
+        # through a process started in the old one
+        gitbatch.release(rc["gitdir"])
+    return tips
+
+
+def _fast_forward_tips(rc):
+    import git
+
+    ns = rc["ns"]
+    comp = rc["comp"]
+    sscm = rc["sscm"]
+    dscm = rc["dscm"]
+    gitdir = rc["gitdir"]
+    try:
+        if os.path.isdir(os.path.join(gitdir, ".git")):
+            repo = git.Repo(gitdir)
+            repo.git.remote("set-url", "origin", dscm["link"])
+        else:
+            repo = git.Repo.init(gitdir)
+            repo.create_remote("origin", dscm["link"])
+        repo.git.fetch("--prune", "origin")
+        repo.git.fetch("--no-tags", sscm["link"], sscm["ref"])
+        batch = gitbatch.engine(gitdir)
+        dtip = batch.resolve("refs/remotes/origin/{}".format(dscm["ref"]))
+        stip = batch.resolve("FETCH_HEAD")
+        if dtip is None or stip is None:
+            return None
+        if dtip != stip:
+            repo.git.merge_base("--is-ancestor", dtip, stip)
+    except git.GitCommandError as e:
+        logger.debug(
+            "Cannot fast-forward %s/%s: %s", ns, comp, str(e.stderr).strip()
+        )
+        return None
+    except Exception:
+        logger.debug("Cannot fast-forward %s/%s.", ns, comp, exc_info=True)
+        return None
+    return dtip, stip
+
+
+def sync_fast_forward(rc, dtip, stip, job, timer):
+    """Fast-forwards the destination branch to the source commit.  The
+    sources files are read from the object store and the source commit is
+    pushed as is, so no working tree is needed.
+
+    :param rc: The resolved component, as returned by resolve_component()
+    :param dtip: The destination commit hash
+    :param stip: The source commit hash, a descendant of dtip
+    :param job: The import job
+    :param timer: The history.Timer of the import
+    :returns: A callable doing the push, as returned by sync_component(),
+    or None on error
+    """
+    import git
+
+    ns = rc["ns"]
+    comp = rc["comp"]
+    dscm = rc["dscm"]
+    logger.debug(
+        "Fast-forwarding %s/%s from %s to %s.", ns, comp, dtip[:12], stip[:12]
+    )
+    batch = gitbatch.engine(rc["gitdir"])
+    dsrc = read_local_sources(batch, dtip, ns, comp)
+    ssrc = read_local_sources(batch, stip, ns, comp)
+    if dsrc is None or ssrc is None:
+        logger.error("Error processing the %s/%s sources files, skipping.", ns, comp)
+        timer.fail()
+        return None
+
+    if not sync_lookaside(rc, ssrc, dsrc, job, timer):
+        return None
 
     logger.debug("Component %s/%s successfully synchronized.", ns, comp)
 
-    if not resync_cache_only:
-        if repo_push(ns, comp, repo, dscm) is None:
-            logger.error("Failed to push %s/%s, skipping.", ns, comp)
+    def push():
+        if job.resync_cache_only:
+            logger.info(
+                "Re-syncing cache only; not attempting to push repo for %s/%s.",
+                ns,
+                comp,
+            )
+        elif dtip == stip:
+            logger.debug("Destination of %s/%s is up-to-date, not pushing.", ns, comp)
+        elif job.dry_run:
+            logger.info(
+                "Running in dry run mode, not pushing %s to %s/%s.",
+                stip[:12],
+                ns,
+                comp,
+            )
+        else:
+            timer.phase("push")
+            try:
+                git.Repo(rc["gitdir"]).git.push(
+                    "origin", "{}:refs/heads/{}".format(stip, dscm["ref"])
+                )
+            except Exception:
+                logger.error("Failed to push %s/%s, skipping.", ns, comp, exc_info=True)
+                timer.fail()
+                return None
+        timer.done()
+
+        logger.info("Successfully synchronized %s/%s.", ns, comp)
+        dscm["commit"] = stip
+        return dscm
+
+    return push
+
+
+def read_local_sources(batch, rev, ns, comp):
+    """Reads and parses the sources file of a revision of a local
+    repository.
+
+    :param batch: The gitbatch.Batch of the repository
+    :param rev: The revision
+    :param ns: The component namespace
+    :param comp: The component name
+    :returns: A set of (filename, hash, hashtype) tuples, or None on error
+    """
+    try:
+        obj = batch.object("{}:sources".format(rev))
+    except Exception:
+        logger.error(
+            "Cannot read the sources file of %s/%s at %s.",
+            ns,
+            comp,
+            rev,
+            exc_info=True,
+        )
+        return None
+    if obj is None or obj[1] != "blob":
+        return parse_sources_text(comp, ns, None)
+    cached = parsed.get(obj[0])
+    if cached is not None:
+        return cached
+    return parse_sources_text(comp, ns, obj[2].decode("utf-8"), obj[0])
+
+
+def read_remote_sources(side, rc, scm, commit, ns, job):
+    """Reads the sources file of a remote repository at a commit.  The
+    repository kept from an earlier run is used if it has the commit,
+    otherwise the file is read straight from the remote.
+
+    :param side: Either "source" or "destination"
+    :param rc: The resolved component, as returned by resolve_component()
+    :param scm: The split scmurl to read from
+    :param commit: The commit hash the ref of scm resolved to
+    :param ns: The namespace of the repository
+    :param job: The import job
+    :returns: The sources file content, or None if there is no such file
+    """
+    if os.path.isdir(os.path.join(rc["gitdir"], ".git")):
+        batch = gitbatch.engine(rc["gitdir"])
+        try:
+            if batch.has(commit):
+                return batch.blob(commit, "sources")
+        except Exception:
+            logger.debug(
+                "Cannot read %s from %s, reading the remote.",
+                commit,
+                rc["gitdir"],
+                exc_info=True,
+            )
+    template = job.c["main"][side].get("files")
+    url = None
+    if template:
+        url = template % {
+            "ns": ns,
+            "component": rc["cname"],
+            "ref": commit,
+            "path": "sources",
+        }
+    return gitremote.read_file(
+        scm["link"], scm["ref"], "sources", url=url, commit=commit
+    )
+
+
+def plan_component(bscm, job):
+    """Works out what importing a component would transfer, using only
+    remote ref listings and single file reads, served from the local
+    repository where it has the commits; no repository is cloned.
+
+    :param bscm: The split scmurl of the component to import
+    :param job: The import job
+    :returns: A dict describing the planned import, or None on error
+    """
+    rc = resolve_component(bscm, job)
+    ns = rc["ns"]
+    comp = rc["comp"]
+    sscm = rc["sscm"]
+    dscm = rc["dscm"]
+    dns = job.alt_ns if job.alt_ns else ns
+    try:
+        stip = gitremote.ls_remote(sscm["link"], sscm["ref"])
+        dtip = gitremote.ls_remote(dscm["link"], dscm["ref"])
+        if stip is None:
+            logger.error(
+                "Source ref %s of %s/%s does not exist, skipping.",
+                sscm["ref"],
+                ns,
+                comp,
+            )
             return None
+        ssrc = parse_sources_text(
+            comp, ns, read_remote_sources("source", rc, sscm, stip, ns, job)
+        )
+        if dtip is None:
+            dsrc = set()
+        else:
+            dsrc = parse_sources_text(
+                comp,
+                ns,
+                read_remote_sources("destination", rc, dscm, dtip, dns, job),
+            )
+    except Exception:
+        logger.error("Failed to read remote state of %s/%s.", ns, comp, exc_info=True)
+        return None
+    finally:
+        gitbatch.release(rc["gitdir"])
+    if ssrc is None or dsrc is None:
+        return None
+
+    plan = {
+        "ns": ns,
+        "comp": comp,
+        "source": stip,
+        "destination": dtip,
+        "files": [],
+        "bytes": 0,
+    }
+    if dtip is None:
+        plan["action"] = "create"
+    elif dtip == stip:
+        plan["action"] = "up-to-date"
     else:
-        logger.info(
-            "Re-syncing cache only; not attempting to push repo for %s/%s.", ns, comp
+        plan["action"] = "merge" if job.c["main"]["control"]["merge"] else "pull"
+    srcdiff = dsrc if job.resync_cache_only else ssrc - dsrc
+    if not srcdiff:
+        return plan
+
+    import pyrpkg
+
+    scname, dcname = cache_names(ns, comp, job)
+    scache = pyrpkg.lookaside.CGILookasideCache(
+        "sha512",
+        job.c["main"]["source"]["cache"]["url"],
+        job.c["main"]["source"]["cache"]["cgi"],
+    )
+    scache.download_path = job.c["main"]["source"]["cache"]["path"]
+    dcache = pyrpkg.lookaside.CGILookasideCache(
+        "sha512",
+        job.c["main"]["destination"]["cache"]["url"],
+        job.c["main"]["destination"]["cache"]["cgi"],
+    )
+    for s in sorted(srcdiff):
+        dcache.hashtype = s[2]
+        try:
+            if dcache.remote_file_exists("{}/{}".format(dns, dcname), s[0], s[1]):
+                continue
+        except Exception:
+            logger.warning(
+                "Cannot check %s for %s/%s in the destination cache.",
+                s[0],
+                ns,
+                comp,
+                exc_info=True,
+            )
+        size = sizes.get("{}/{}".format(ns, scname), s[0], s[1])
+        if size is None:
+            size = lookaside.remote_file_size(
+                scache, "{}/{}".format(ns, scname), s[0], s[1], s[2]
+            )
+            if size is not None:
+                sizes.set("{}/{}".format(ns, scname), s[0], s[1], size)
+        plan["files"].append((s[0], size))
+        plan["bytes"] += size or 0
+    return plan
+
+
+def audit_sources(bscm, job):
+    """Reads the destination sources file of a component for an audit.
+
+    :param bscm: The split scmurl of the component
+    :param job: The import job
+    :returns: A (resolved component, set of source tuples) tuple, or None
+    on error
+    """
+    rc = resolve_component(bscm, job)
+    ns = rc["ns"]
+    comp = rc["comp"]
+    dscm = rc["dscm"]
+    dns = job.alt_ns if job.alt_ns else ns
+    try:
+        dtip = gitremote.ls_remote(dscm["link"], dscm["ref"])
+        if dtip is None:
+            logger.error(
+                "Destination ref %s of %s/%s does not exist, skipping.",
+                dscm["ref"],
+                ns,
+                comp,
+            )
+            return None
+        dsrc = parse_sources_text(
+            comp,
+            ns,
+            read_remote_sources("destination", rc, dscm, dtip, dns, job),
         )
+    except Exception:
+        logger.error(
+            "Failed to read the destination of %s/%s.", ns, comp, exc_info=True
+        )
+        return None
+    finally:
+        gitbatch.release(rc["gitdir"])
+    if dsrc is None:
+        return None
+    return rc, dsrc
 
-    logger.info("Successfully synchronized %s/%s.", ns, comp)
 
+def audit(bscms, job, jobs, repair=False):
+    """Checks that the destination lookaside cache has every file the
+    destination sources files of the given components reference, and
+    optionally synchronizes the missing ones.  The sources files are read
+    concurrently, then all files of all components are checked at once on
+    a pool of audit_workers, each file only once.
+
+    :param bscms: The split scmurls of the components to audit
+    :param job: The import job
+    :param jobs: The number of components to read or repair concurrently
+    :param repair: Synchronize the missing files
+    :returns: The number of components that are, or may be, incomplete
+    """
+    import pyrpkg
+
+    def read(bscm):
+        with logsink.tagged("{}/{}".format(bscm["ns"], bscm["comp"]), job.name):
+            return audit_sources(bscm, job)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        audited = list(executor.map(read, bscms))
+    incomplete = audited.count(None)
+    audited = [a for a in audited if a is not None]
+
+    dcache = pyrpkg.lookaside.CGILookasideCache(
+        "sha512",
+        job.c["main"]["destination"]["cache"]["url"],
+        job.c["main"]["destination"]["cache"]["cgi"],
+    )
+    dcache.download_path = job.c["main"]["destination"]["cache"]["path"]
+    keys = {}
+    for rc, dsrc in audited:
+        _, dcname = cache_names(rc["ns"], rc["comp"], job)
+        name = "{}/{}".format(job.alt_ns if job.alt_ns else rc["ns"], dcname)
+        for s in dsrc:
+            keys[(rc["ns"], rc["comp"], s)] = (name,) + s
+    started = time.monotonic()
+    exists = lookaside.files_exist(dcache, set(keys.values()), audit_workers)
+    logger.info(
+        "Checked %d file(s) of %d component(s) in %.1fs.",
+        len(exists),
+        len(audited),
+        time.monotonic() - started,
+    )
+
+    missing = {}
+    for rc, dsrc in audited:
+        ns = rc["ns"]
+        comp = rc["comp"]
+        lost = {s for s in dsrc if exists[keys[(ns, comp, s)]] is False}
+        unknown = {s for s in dsrc if exists[keys[(ns, comp, s)]] is None}
+        print(
+            "{}/{}: {} file(s), {} missing{}".format(
+                ns,
+                comp,
+                len(dsrc),
+                len(lost),
+                ", {} unchecked".format(len(unknown)) if unknown else "",
+            )
+        )
+        for s in sorted(lost):
+            print("    {} {} {}".format(s[0], s[2], s[1]))
+        if lost:
+            missing[(ns, comp)] = lost
+        if lost or unknown:
+            incomplete += 1
+    print(
+        "Total: {} component(s), {} file(s), {} missing".format(
+            len(audited), len(exists), sum(len(m) for m in missing.values())
+        )
+    )
+    if not repair or not missing:
+        return incomplete
+
+    def fix(item):
+        (ns, comp), lost = item
+        with logsink.tagged("{}/{}".format(ns, comp), job.name):
+            logger.info("Repairing %d missing file(s).", len(lost))
+            return sync_cache(comp, lost, ns, dns=job.alt_ns, job=job)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        repaired = [r is not None for r in executor.map(fix, missing.items())]
+    sizes.save()
+    logger.info(
+        "Repaired %d of %d incomplete component(s).",
+        repaired.count(True),
+        len(repaired),
+    )
+    return incomplete - repaired.count(True)
+
+
+def promote_component(bscm, job):
+    """Promotes a component imported into the alternate namespace to the
+    standard namespace: the commit of the alternate destination branch is
+    pushed as is to the standard destination branch, and the lookaside
+    files it adds are copied from the content store or from the alternate
+    namespace of the destination cache.  The source is not fetched again;
+    the repository kept from the import is reused, so the fetches only
+    negotiate what it already has.
+
+    :param bscm: The split scmurl of the component to promote
+    :param job: The import job, with an alternate namespace
+    :returns: The standard destination scm dict, with the promoted commit
+    hash added as "commit", or None on error
+    """
+    import git
+
+    rc = resolve_component(bscm, job)
+    ns = rc["ns"]
+    comp = rc["comp"]
+    tscm = rc["dscm"]
+    pscm = resolve_component(
+        bscm,
+        Job(job.c, dry_run=job.dry_run, repo_base=job.repo_base, name=job.name),
+    )["dscm"]
+    gitdir = rc["gitdir"]
+    key = "{}/{}".format(ns, comp)
+    timer = history.Timer(run, ns, comp, job.name)
+    tracked = (job.name, ns, comp)
+    progress.tracker.start(tracked)
+    result = None
+    try:
+        with logsink.tagged(key, job.name), repos.use(
+            gitdir
+        ), contextlib.ExitStack() as stack:
+            stack.callback(gitbatch.release, gitdir)
+            logger.info("Promoting %s from %s.", key, job.alt_ns)
+            timer.phase("fetch")
+            try:
+                if os.path.isdir(os.path.join(gitdir, ".git")):
+                    repo = git.Repo(gitdir)
+                else:
+                    repo = git.Repo.init(gitdir)
+                repo.git.fetch(
+                    "--no-tags",
+                    tscm["link"],
+                    "+refs/heads/{}:refs/promote/alt".format(tscm["ref"]),
+                )
+            except Exception:
+                logger.error(
+                    "Cannot fetch %s#%s, skipping.",
+                    tscm["link"],
+                    tscm["ref"],
+                    exc_info=True,
+                )
+                timer.fail()
+                return None
+            try:
+                if gitremote.ls_remote(pscm["link"], pscm["ref"]) is None:
+                    logger.debug("%s#%s is a new branch.", pscm["link"], pscm["ref"])
+                    repo.git.update_ref("-d", "refs/promote/standard")
+                else:
+                    repo.git.fetch(
+                        "--no-tags",
+                        pscm["link"],
+                        "+refs/heads/{}:refs/promote/standard".format(pscm["ref"]),
+                    )
+            except Exception:
+                logger.error(
+                    "Cannot fetch %s#%s, skipping.",
+                    pscm["link"],
+                    pscm["ref"],
+                    exc_info=True,
+                )
+                timer.fail()
+                return None
+            batch = gitbatch.engine(gitdir)
+            ttip = batch.resolve("refs/promote/alt")
+            ptip = batch.resolve("refs/promote/standard")
+            if ptip is not None and ptip != ttip:
+                try:
+                    repo.git.merge_base("--is-ancestor", ptip, ttip)
+                except git.GitCommandError:
+                    logger.error(
+                        "Cannot promote %s, %s is not a fast-forward of %s.",
+                        key,
+                        job.alt_ns,
+                        ns,
+                    )
+                    timer.fail()
+                    return None
+
+            tsrc = read_local_sources(batch, ttip, ns, comp)
+            psrc = read_local_sources(batch, ptip, ns, comp) if ptip else set()
+            if tsrc is None or psrc is None:
+                logger.error("Error processing the %s sources files, skipping.", key)
+                timer.fail()
+                return None
+
+            timer.phase("lookaside")
+            srcdiff = tsrc - psrc
+            if srcdiff:
+                stats = {}
+                if (
+                    sync_cache(
+                        comp, srcdiff, ns, stats=stats, job=job, origin=job.alt_ns
+                    )
+                    is None
+                ):
+                    logger.error(
+                        "Failed to promote the lookaside files of %s, skipping.", key
+                    )
+                    timer.fail()
+                    return None
+                timer.bytes = stats["bytes"]
+
+            if ptip == ttip:
+                logger.debug("%s is up-to-date, not pushing.", key)
+            elif job.dry_run:
+                logger.info(
+                    "Running in dry run mode, not pushing %s to %s.", ttip[:12], key
+                )
+            else:
+                timer.phase("push")
+                try:
+                    repo.git.push(
+                        pscm["link"], "{}:refs/heads/{}".format(ttip, pscm["ref"])
+                    )
+                except Exception:
+                    logger.error("Failed to push %s, skipping.", key, exc_info=True)
+                    timer.fail()
+                    return None
+            timer.done()
+            logger.info("Successfully promoted %s as %s.", key, ttip[:12])
+            result = dict(pscm, commit=ttip)
+            return result
+    finally:
+        progress.tracker.finish(tracked, result is not None)
+
+
+def print_plan(plans):
+    """Prints the planned imports and their totals."""
+    files = 0
+    total = 0
+    for plan in plans:
+        print(
+            "{}/{}: {} {} -> {}, {} file(s), {} bytes".format(
+                plan["ns"],
+                plan["comp"],
+                plan["action"],
+                plan["source"][:12],
+                plan["destination"][:12] if plan["destination"] else "(none)",
+                len(plan["files"]),
+                plan["bytes"],
+            )
+        )
+        for filename, size in plan["files"]:
+            print("    {} {}".format(filename, size if size is not None else "?"))
+        files += len(plan["files"])
+        total += plan["bytes"]
+    print("Total: {} component(s), {} file(s), {} bytes".format(len(plans), files, total))
+
+
+def watch(bscms, interval, jobs, job):
+    """Keeps polling the source refs of the given components and imports
+    each component as soon as its source tip moves.  Repositories, HTTP
+    sessions and lib/distrobaker stay loaded between imports.  Every
+    import is logged as a JSON event with its timing to watch_events.
+    Runs until SIGINT or SIGTERM.
+
+    :param bscms: The split scmurls of the components to watch
+    :param interval: The number of seconds between polls
+    :param jobs: The number of components to import concurrently
+    :param job: The import job
+    """
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    tips = {}
+    if os.path.isfile(watch_state):
+        with open(watch_state, "r") as fh:
+            tips = json.load(fh)
+    lock = threading.Lock()
+    inflight = set()
+
+    def save():
+        os.makedirs(os.path.dirname(watch_state), exist_ok=True)
+        tmpname = "{}.{}".format(watch_state, os.getpid())
+        with open(tmpname, "w") as fh:
+            json.dump(tips, fh, indent=2)
+        os.replace(tmpname, watch_state)
+        save_sources_index()
+
+    def poll(bscm):
+        rc = resolve_component(bscm, job)
+        try:
+            return gitremote.ls_remote(rc["sscm"]["link"], rc["sscm"]["ref"])
+        except Exception:
+            logger.warning(
+                "Cannot list the source ref of %s/%s.",
+                bscm["ns"],
+                bscm["comp"],
+                exc_info=True,
+            )
+            return None
+
+    def event(key, tip, started, dscm):
+        record = {
+            "time": time.time(),
+            "component": key,
+            "source": tip,
+            "outcome": "failed" if dscm is None else "imported",
+            "commit": dscm["commit"] if dscm else None,
+            "duration": round(time.monotonic() - started, 3),
+        }
+        logger.info("Import event: %s", json.dumps(record))
+        with lock:
+            os.makedirs(os.path.dirname(watch_events), exist_ok=True)
+            with open(watch_events, "a") as fh:
+                fh.write(json.dumps(record) + "\n")
+
+    def work(key, bscm, tip):
+        started = time.monotonic()
+        dscm = None
+        try:
+            dscm = import_component(bscm, job)
+        except Exception:
+            logger.error("Unexpected error importing %s.", key, exc_info=True)
+        event(key, tip, started, dscm)
+        with lock:
+            inflight.discard(key)
+            if dscm is not None:
+                tips[key] = tip
+                save()
+
+    logger.info("Watching %d component(s) every %ds.", len(bscms), interval)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as poller:
+            while not stop.is_set():
+                started = time.monotonic()
+                for bscm, tip in zip(bscms, poller.map(poll, bscms)):
+                    key = "{}/{}#{}".format(bscm["ns"], bscm["comp"], bscm["ref"])
+                    if job.name:
+                        key = "{}:{}".format(job.name, key)
+                    with lock:
+                        if tip is None or tips.get(key) == tip or key in inflight:
+                            continue
+                        inflight.add(key)
+                    logger.info(
+                        "Source of %s moved to %s, importing.", key, tip[:12]
+                    )
+                    progress.tracker.add()
+                    executor.submit(work, key, bscm, tip)
+                logger.debug(
+                    "Polled %d source ref(s) in %.1fs.",
+                    len(bscms),
+                    time.monotonic() - started,
+                )
+                stop.wait(interval)
+        logger.info("Stopping, waiting for running imports to finish.")
+
+
+def worker_rlimits(limits):
+    """Returns a function setting the memory and CPU limits as rlimits, to
+    be run in the worker process between fork and exec, so that they are
+    in place before the worker starts and are inherited by its git
+    processes.  The rlimits are worked out here, as the function must not
+    do more than the setrlimit calls.
+
+    :param limits: A dict of limits, see worker_limits
+    """
+    rlimits = []
+    if limits.get("memory"):
+        rlimits.append((resource.RLIMIT_AS, (limits["memory"], limits["memory"])))
+    if limits.get("cpu"):
+        rlimits.append((resource.RLIMIT_CPU, (limits["cpu"], limits["cpu"] + 10)))
+
+    def apply():
+        for which, value in rlimits:
+            resource.setrlimit(which, value)
+
+    return apply
+
+
+def run_isolated(rec, argv, limits, job):
+    """Imports a component in a worker subprocess running this script with
+    resource limits.  The memory and CPU limits are set as rlimits, which
+    the worker's git processes inherit.  The scratch directory, which the
+    worker uses as TMPDIR, and the wall-clock deadline are watched from
+    here; a worker exceeding them is killed along with its processes.
+
+    :param rec: The component argument
+    :param argv: The worker command line, without the component
+    :param limits: A dict of limits, see worker_limits
+    :param job: The import job the worker runs
+    :returns: The destination scm dict, with the imported commit hash added
+    as "commit", or None on error
+    """
+    bscm = split_scmurl(rec)
+    key = "{}/{}".format(bscm["ns"], bscm["comp"])
+    tracked = (job.name, bscm["ns"], bscm["comp"])
+    if scratch_root:
+        os.makedirs(scratch_root, exist_ok=True)
+    scratch = tempfile.mkdtemp(
+        prefix="worker-{}-{}-".format(bscm["ns"], bscm["comp"]), dir=scratch_root
+    )
+    resultfile = os.path.join(scratch, "result.json")
+    progress.tracker.start(tracked)
+    progress.tracker.phase(tracked, "worker")
+    started = time.monotonic()
+    exceeded = None
+    result = None
+    try:
+        try:
+            proc = subprocess.Popen(
+                argv + ["--worker-result", resultfile, rec],
+                env=dict(os.environ, TMPDIR=scratch),
+                start_new_session=True,
+                preexec_fn=worker_rlimits(limits),
+            )
+        except (OSError, subprocess.SubprocessError):
+            logger.error("Cannot start the limited worker of %s.", key, exc_info=True)
+            return result
+        while True:
+            try:
+                proc.wait(timeout=5)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if (
+                limits.get("deadline")
+                and time.monotonic() - started > limits["deadline"]
+            ):
+                exceeded = "wall-clock deadline"
+            elif (
+                limits.get("scratch")
+                and repocache.disk_usage(scratch) > limits["scratch"]
+            ):
+                exceeded = "scratch disk"
+            if exceeded:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+                break
+        if exceeded:
+            logger.error(
+                "Killed the import of %s after %.0fs, it exceeded its %s limit.",
+                key,
+                time.monotonic() - started,
+                exceeded,
+            )
+            return result
+        if proc.returncode < 0:
+            logger.error(
+                "The import worker of %s was killed by %s.",
+                key,
+                signal.Signals(-proc.returncode).name,
+            )
+        elif proc.returncode:
+            logger.error(
+                "The import worker of %s exited with status %d.", key, proc.returncode
+            )
+        try:
+            with open(resultfile, "r") as fh:
+                result = json.load(fh).get(key)
+        except (OSError, ValueError):
+            pass
+        return result
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        progress.tracker.finish(tracked, result is not None)
+
+
+def worker_argv(args, job, rundir):
+    """Returns the command line of the isolated workers, without the
+    component, passing on the options that apply to a single import.  The
+    transfers and bandwidth limits are divided between the concurrent
+    workers.
+
+    :param args: The parsed command line arguments
+    :param job: The import job
+    :param rundir: The log directory of the run, or None
+    """
+    argv = [
+        sys.executable,
+        os.path.abspath(sys.argv[0]),
+        "--jobs",
+        "1",
+        "--push-jobs",
+        "0",
+        "--transfers",
+        str(max(1, args.transfers // max(1, args.jobs))),
+        "--no-status-line",
+        "--log-dir",
+        os.path.join(rundir if rundir else args.log_dir, "workers"),
+    ]
+    if job.dry_run:
+        argv.append("--dry-run")
+    if not args.log_files:
+        argv.append("--no-log-files")
+    if not args.history:
+        argv.append("--no-history")
+    if args.profile:
+        argv.append("--profile")
+    if args.cprofile:
+        argv.append("--cprofile")
+    if args.distrobaker:
+        argv += ["--distrobaker", args.distrobaker]
+    for name, bucket in (
+        ("--download-limit", lookaside.download_limit),
+        ("--upload-limit", lookaside.upload_limit),
+    ):
+        if bucket.rate:
+            argv += [name, str(max(1, bucket.rate // max(1, args.jobs)))]
+    if args.limits:
+        argv += [
+            "--limits",
+            os.path.abspath(args.limits),
+            "--limits-share",
+            str(max(1, args.jobs)),
+        ]
+    return argv
+
+
+def save_sources_index():
+    """Writes the parsed sources files of this run to the sources index."""
+    try:
+        parsed.save()
+    except Exception:
+        logger.warning("Cannot save sources index %s.", sources_index, exc_info=True)
+
+
+def write_profile(directory):
+    """Writes the profiling report of the run to directory/profile.txt, or
+    to stdout without a directory."""
+    prof = profiling.profiler()
+    if prof is None:
+        return
+    if not directory:
+        prof.report(sys.stdout)
+        return
+    path = os.path.join(directory, "profile.txt")
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as fh:
+        prof.report(fh)
+    logger.info("Profile written to %s.", path)
+
+
+def main(argv=None, job=None):
+    """Runs the command line interface.
+
+    :param argv: The command line arguments, defaults to sys.argv
+    :param job: The import job, defaults to the module level configuration
+    """
+    global run, profile_dir
 
-if __name__ == "__main__":
     parser = argparse.ArgumentParser(
-        description="Import components into the redhat/centos-stream/temp namespace in gitlab."
+        description="Import components into the redhat/centos-stream/temp namespace in gitlab.",
+        fromfile_prefix_chars="@",
     )
     parser.add_argument(
-        "comps", metavar="comps", nargs="+", help="The components to import"
+        "comps", metavar="comps", nargs="*", help="The components to import"
+    )
+    parser.add_argument(
+        "-M",
+        "--manifest",
+        action="append",
+        metavar="FILE",
+        help="A component list file to import, compiled into a cached "
+        "manifest; may be given more than once",
+        default=[],
     )
     parser.add_argument(
         "-n",
@@ -396,18 +2085,400 @@ if __name__ == "__main__":
         help="Do not upload or push",
         default=False,
     )
+    # the modes other than importing
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument(
+        "-p",
+        "--plan",
+        action="store_true",
+        help="Only show what would be imported, without cloning anything",
+        default=False,
+    )
+    modes.add_argument(
+        "-a",
+        "--audit",
+        action="store_true",
+        help="Only check that the destination lookaside cache has every file "
+        "the destination sources files reference",
+        default=False,
+    )
+    modes.add_argument(
+        "--promote",
+        action="store_true",
+        help="Push the components already imported into the alternate "
+        "namespace to the standard namespace, with their lookaside files, "
+        "without importing them again",
+        default=False,
+    )
+    modes.add_argument(
+        "--repair",
+        action="store_true",
+        help="Audit, and synchronize the missing lookaside files",
+        default=False,
+    )
+    modes.add_argument(
+        "-w",
+        "--watch",
+        type=int,
+        metavar="SECONDS",
+        help="Keep running, polling the source refs every SECONDS and importing "
+        "the components whose source changed",
+        default=0,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of components to import concurrently",
+        default=1,
+    )
+    parser.add_argument(
+        "--push-jobs",
+        type=int,
+        help="Number of concurrent pushes, run apart from the imports; 0 "
+        "pushes on the importing worker",
+        default=push_workers,
+    )
+    parser.add_argument(
+        "--isolate",
+        action="store_true",
+        help="Import each component in its own worker process, with resource "
+        "limits",
+        default=False,
+    )
+    parser.add_argument(
+        "--memory-limit",
+        metavar="SIZE",
+        help="With --isolate, the address space limit of each worker process "
+        "and its git processes",
+        default=None,
+    )
+    parser.add_argument(
+        "--cpu-limit",
+        type=int,
+        metavar="SECONDS",
+        help="With --isolate, the CPU time limit of each worker process and "
+        "its git processes",
+        default=None,
+    )
+    parser.add_argument(
+        "--scratch-limit",
+        metavar="SIZE",
+        help="With --isolate, the limit of the temporary files of each worker",
+        default=None,
+    )
+    parser.add_argument(
+        "--deadline",
+        type=int,
+        metavar="SECONDS",
+        help="With --isolate, the wall-clock time limit of each component import",
+        default=None,
+    )
+    parser.add_argument("--worker-result", help=argparse.SUPPRESS, default=None)
+    parser.add_argument("--limits-share", type=int, help=argparse.SUPPRESS, default=1)
+    parser.add_argument(
+        "-t",
+        "--transfers",
+        type=int,
+        help="Number of concurrent lookaside transfers across all components",
+        default=transfer_workers,
+    )
+    parser.add_argument(
+        "--download-limit",
+        metavar="RATE",
+        help="Limit all lookaside downloads together to RATE bytes per "
+        "second, with an optional K, M or G suffix",
+        default=None,
+    )
+    parser.add_argument(
+        "--upload-limit",
+        metavar="RATE",
+        help="Limit all lookaside uploads together to RATE bytes per second",
+        default=None,
+    )
+    parser.add_argument(
+        "--limits",
+        metavar="FILE",
+        help='Apply the rates of a JSON file such as {"download": "20M", '
+        '"upload": "5M"} whenever it changes, overriding the other limits',
+        default=None,
+    )
+    parser.add_argument(
+        "-m",
+        "--maintain",
+        type=int,
+        metavar="SECONDS",
+        help="Run git maintenance on idle repositories for up to SECONDS after importing",
+        default=0,
+    )
+    parser.add_argument(
+        "--no-history",
+        dest="history",
+        action="store_false",
+        help="Do not record timings in the run history",
+        default=True,
+    )
+    parser.add_argument(
+        "--log-dir",
+        metavar="DIR",
+        help="Write per-component JSON logs into a new directory below DIR",
+        default=log_dir,
+    )
+    parser.add_argument(
+        "--no-log-files",
+        dest="log_files",
+        action="store_false",
+        help="Only log the summary to stderr",
+        default=True,
+    )
+    parser.add_argument(
+        "--status",
+        metavar="FILE",
+        help="Periodically write the progress of the run to a JSON file, "
+        "status.json in the run log directory by default",
+        default=None,
+    )
+    parser.add_argument(
+        "--no-status-line",
+        dest="status_line",
+        action="store_false",
+        help="Do not show a progress line on the terminal",
+        default=True,
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Count and time the git commands and HTTP requests of each "
+        "component and write a report of the most expensive ones",
+        default=False,
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        help="With --profile, also capture cProfile data of each component",
+        default=False,
+    )
+    parser.add_argument(
+        "--distrobaker",
+        metavar="PATH",
+        help="The lib directory of a distrobaker checkout",
+        default=None,
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    distrobaker.loglevel(logging.DEBUG)
+    rundir = None
+    if args.log_files:
+        rundir = os.path.join(
+            args.log_dir, "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+        )
+    logsink.setup(rundir)
+    logger.setLevel(logging.DEBUG)
     logger.debug("Logging configured")
+    if rundir:
+        logger.info("Writing component logs to %s.", rundir)
 
-    distrobaker.dry_run = dry_run = args.dry_run
+    job = job if job else default_job()
+    if args.dry_run:
+        job.dry_run = True
+    if args.distrobaker:
+        distrobaker_lib.insert(0, args.distrobaker)
 
-    if dry_run:
+    if job.dry_run:
         logger.info("Dry run enabled. Nothing will be uploaded/pushed.")
 
+    scheduler.workers = args.transfers
+    try:
+        lookaside.download_limit.rate = lookaside.parse_rate(args.download_limit)
+        lookaside.upload_limit.rate = lookaside.parse_rate(args.upload_limit)
+    except ValueError:
+        parser.error("Invalid rate limit")
+    if args.limits:
+        lookaside.watch_limits(args.limits, share=max(1, args.limits_share))
+
+    if args.profile:
+        profiling.install()
+        if args.cprofile:
+            profile_dir = os.path.join(rundir if rundir else os.getcwd(), "profiles")
+
+    if not args.comps and not args.manifest:
+        parser.error("no components given")
     for rec in args.comps:
         logger.info("Processing argument %s.", rec)
-        bscm = split_scmurl(rec)
-        import_component(bscm)
+    try:
+        entries = load_manifest(args.comps, args.manifest, job)
+    except (OSError, ValueError) as e:
+        logger.critical("%s", e)
+        sys.exit(1)
+
+    # start the components with the most lookaside content first; the
+    # components sharing a repository go together, as a group
+    groups = sorted(
+        (
+            [entries.entries[i] for i in indexes]
+            for indexes in entries.groups.values()
+        ),
+        key=lambda group: sum(sizes.component_total(e["ns"], e["comp"]) for e in group),
+        reverse=True,
+    )
+    bscms = [split_scmurl(e["rec"]) for group in groups for e in group]
+
+    if args.plan:
+
+        def plan(bscm):
+            with logsink.tagged("{}/{}".format(bscm["ns"], bscm["comp"]), job.name):
+                return plan_component(bscm, job)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            plans = [p for p in executor.map(plan, bscms) if p is not None]
+        sizes.save()
+        print_plan(plans)
+        save_sources_index()
+        write_profile(rundir)
+        sys.exit(0 if len(plans) == len(bscms) else 1)
+
+    if args.audit or args.repair:
+        if args.repair:
+            try:
+                load_distrobaker()
+            except ImportError as e:
+                logger.critical("%s", e)
+                sys.exit(1)
+        incomplete = audit(bscms, job, args.jobs, repair=args.repair)
+        save_sources_index()
+        write_profile(rundir)
+        sys.exit(1 if incomplete else 0)
+
+    try:
+        load_distrobaker()
+    except ImportError as e:
+        logger.critical("%s", e)
+        sys.exit(1)
+
+    if args.promote:
+        if not job.alt_ns:
+            parser.error("--promote needs an alternate namespace to promote from")
+        if args.history:
+            run = history.History(history_db).start_run(sys.argv[0], sys.argv[1:])
+        progress.tracker.add(len(bscms))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            promoted = list(executor.map(lambda b: promote_component(b, job), bscms))
+        if run:
+            run.finish()
+        save_sources_index()
+        write_profile(rundir)
+        logger.info(
+            "Promoted %d of %d component(s).",
+            len(promoted) - promoted.count(None),
+            len(promoted),
+        )
+        sys.exit(1 if None in promoted else 0)
+
+    if args.history:
+        run = history.History(history_db).start_run(sys.argv[0], sys.argv[1:])
+
+    status = args.status
+    if status is None and rundir:
+        status = os.path.join(rundir, "status.json")
+    reporter = progress.Reporter(status, line=args.status_line).start()
+
+    if args.watch:
+        watch(bscms, args.watch, args.jobs, job)
+        reporter.stop()
+        if run:
+            run.finish()
+        save_sources_index()
+        write_profile(rundir)
+        sys.exit(0)
+
+    pushes = PushQueue(args.push_jobs) if args.push_jobs > 0 else None
+    if args.isolate:
+        limits = dict(worker_limits)
+        try:
+            for name in ("memory", "scratch"):
+                if getattr(args, name + "_limit") is not None:
+                    limits[name] = lookaside.parse_size(getattr(args, name + "_limit"))
+        except ValueError:
+            parser.error("Invalid size limit")
+        if args.cpu_limit is not None:
+            limits["cpu"] = args.cpu_limit or None
+        if args.deadline is not None:
+            limits["deadline"] = args.deadline or None
+        wargv = worker_argv(args, job, rundir)
+    progress.tracker.add(len(bscms))
+    outcomes = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {}
+        for group in groups:
+            if args.isolate:
+                for entry in group:
+                    future = executor.submit(
+                        run_isolated, entry["rec"], wargv, limits, job
+                    )
+                    futures[future] = [entry]
+            else:
+                futures[executor.submit(import_group, group, job, pushes)] = group
+        for future in concurrent.futures.as_completed(futures):
+            group = futures[future]
+            try:
+                results = future.result()
+                if args.isolate:
+                    results = [results]
+            except Exception:
+                results = [None] * len(group)
+                logger.error(
+                    "Unexpected error importing %s.",
+                    ", ".join(e["rec"] for e in group),
+                    exc_info=True,
+                )
+            for entry, result in zip(group, results):
+                outcomes.append(("{}/{}".format(entry["ns"], entry["comp"]), result))
+    if pushes is not None:
+        results = pushes.results()
+        pushes.shutdown()
+        failed = [key for key, dscm in results if dscm is None]
+        logger.info(
+            "Pushed %d component(s), %d failed.",
+            len(results) - len(failed),
+            len(failed),
+        )
+        for key, dscm in results:
+            if dscm is None:
+                logger.error("Push of %s failed.", key)
+            else:
+                logger.debug("Pushed %s as %s.", key, dscm["commit"])
+
+    outcomes = [(key, PushQueue.outcome(o)) for key, o in outcomes]
+    failed = sorted(key for key, dscm in outcomes if dscm is None)
+    if failed:
+        logger.error(
+            "Failed to import %d of %d component(s): %s",
+            len(failed),
+            len(outcomes),
+            ", ".join(failed),
+        )
+
+    if args.worker_result:
+        with open(args.worker_result, "w") as fh:
+            json.dump(dict(outcomes), fh)
+
+    reporter.stop()
+    if run:
+        run.finish()
+    save_sources_index()
+    write_profile(rundir)
+
+    # isolated workers leave pruning to the parent, rather than each of
+    # them walking the whole store
+    if not args.worker_result:
+        removed = store.prune()
+        if removed:
+            logger.info("Pruned %d file(s) from the content store.", removed)
+
+    if args.maintain:
+        repos.maintain(args.maintain)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+
+# Structured logging for the import scripts.
+#
+# Records are tagged with the job, component and phase being worked on and
+# the worker thread, handed to a queue without blocking, and written by a
+# single listener thread as JSON lines into one buffered file per job and
+# component, plus a concise summary on stderr.
+
+import atexit
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+
+# the job, component and phase the current task works on; context
+# variables follow tasks onto the transfer scheduler threads
+job = contextvars.ContextVar("job", default=None)
+component = contextvars.ContextVar("component", default=None)
+phase = contextvars.ContextVar("phase", default=None)
+
+# the file untagged records go to
+RUNLOG = "run"
+
+_listener = None
+
+
+@contextlib.contextmanager
+def tagged(name, job_name=None):
+    """Tags the records logged within the context with a component.
+
+    :param name: The component, as namespace/component
+    :param job_name: The name of the import job, if any
+    """
+    jtoken = job.set(job_name)
+    ctoken = component.set(name)
+    ptoken = phase.set(None)
+    try:
+        yield
+    finally:
+        phase.reset(ptoken)
+        component.reset(ctoken)
+        job.reset(jtoken)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the job, component, phase and worker attributes to records."""
+
+    def filter(self, record):
+        record.job = job.get()
+        record.component = component.get()
+        record.phase = phase.get()
+        record.worker = record.threadName
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single line JSON objects."""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "job": getattr(record, "job", None),
+            "component": getattr(record, "component", None),
+            "phase": getattr(record, "phase", None),
+            "worker": getattr(record, "worker", record.threadName),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class ComponentFileHandler(logging.Handler):
+    """Writes records into one buffered file per component, named after
+    the component, below a directory; records of named jobs go into a
+    subdirectory per job, as several jobs may import the same component.
+    Only the least recently used files are closed when more than max_open
+    are needed.
+
+    :param directory: The log directory
+    :param buffering: The write buffer size of each file
+    :param max_open: The number of files kept open
+    """
+
+    def __init__(self, directory, buffering=64 * 1024, max_open=64):
+        super().__init__()
+        self.directory = directory
+        self.buffering = buffering
+        self.max_open = max_open
+        self._files = collections.OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name, job_name=None):
+        """Returns the log file of a component of a job."""
+        directory = self.directory
+        if job_name:
+            directory = os.path.join(directory, self._safe(job_name))
+        return os.path.join(directory, self._safe(name) + ".jsonl")
+
+    @staticmethod
+    def _safe(name):
+        return re.sub(r"[^A-Za-z0-9._+-]", "_", name)
+
+    def _file(self, name, job_name=None):
+        key = (job_name, name)
+        fh = self._files.get(key)
+        if fh is not None:
+            self._files.move_to_end(key)
+            return fh
+        while len(self._files) >= self.max_open:
+            self._files.popitem(last=False)[1].close()
+        path = self.path(name, job_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fh = open(path, "a", buffering=self.buffering)
+        self._files[key] = fh
+        return fh
+
+    def emit(self, record):
+        try:
+            name = getattr(record, "component", None)
+            job_name = getattr(record, "job", None) if name else None
+            self._file(name or RUNLOG, job_name).write(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        for fh in self._files.values():
+            fh.flush()
+
+    def close(self):
+        for fh in self._files.values():
+            fh.close()
+        self._files.clear()
+        super().close()
+
+
+class SummaryFormatter(logging.Formatter):
+    """A concise one line format for the terminal.
+
+    :param clear: Clear the current terminal line first, which may hold a
+    status line
+    """
+
+    def __init__(self, clear=False):
+        super().__init__()
+        self.clear = clear
+
+    def format(self, record):
+        tag = getattr(record, "component", None)
+        if tag and getattr(record, "phase", None):
+            tag = "{}:{}".format(tag, record.phase)
+        line = "{}{} {:7} [{}] {}{}".format(
+            "\r\x1b[K" if self.clear else "",
+            self.formatTime(record, "%H:%M:%S"),
+            record.levelname,
+            getattr(record, "worker", record.threadName),
+            "{}: ".format(tag) if tag else "",
+            record.getMessage(),
+        )
+        if record.levelno >= logging.ERROR:
+            if record.exc_info and not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            if record.exc_text:
+                line += "\n" + record.exc_text
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # the listener formats the records, so only make them safe to pass
+    # between threads instead of formatting them twice
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup(directory=None, level=logging.DEBUG, summary_level=logging.INFO):
+    """Routes all logging through a queue to the per-component files and
+    the summary stream.  Logging calls only enqueue the record; the files
+    are written by a listener thread.  Without a directory, only the
+    summary is written.
+
+    :param directory: The directory for the per-component JSON log files
+    :param level: The level of the records logged
+    :param summary_level: The minimum level shown in the summary
+    :returns: The directory the files are written to
+    """
+    global _listener
+    shutdown()
+    summary = logging.StreamHandler(sys.stderr)
+    summary.setLevel(summary_level)
+    summary.setFormatter(SummaryFormatter(clear=sys.stderr.isatty()))
+    handlers = [summary]
+    if directory:
+        files = ComponentFileHandler(directory)
+        files.setFormatter(JsonFormatter())
+        handlers.append(files)
+    q = queue.SimpleQueue()
+    qh = _QueueHandler(q)
+    qh.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(qh)
+    # do not queue records nothing would write
+    root.setLevel(level if directory else max(level, summary_level))
+    _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+    return directory
+
+
+def shutdown():
+    """Stops the listener after it wrote the queued records and flushes
+    and closes the files."""
+    global _listener
+    atexit.unregister(shutdown)
+    if _listener is None:
+        return
+    _listener.stop()
+    for h in _listener.handlers:
+        h.close()
+    _listener = None
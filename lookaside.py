@@ -0,0 +1,870 @@
+#!/usr/bin/python3
+
+# Helpers for moving files between lookaside caches, shared by the
+# import-components*.py scripts.
+
+import concurrent.futures
+import contextvars
+import copy
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# size of the pieces files are read and sent in
+CHUNK_SIZE = 8 * 1024 * 1024
+
+_sessions = threading.local()
+
+
+class TokenBucket(object):
+    """Limits the throughput of all transfers sharing it to a rate, in
+    bytes per second.  Transfers reserve their bytes in small pieces, in
+    the order they ask for them, so concurrent transfers get an equal
+    share.  Idle time builds up a credit of at most burst seconds.
+
+    The rate may be changed at any time; None means no limit.
+
+    The total number of bytes consumed is counted in total, whether the
+    rate is limited or not.
+
+    :param rate: The rate in bytes per second, or None
+    :param burst: The maximum credit in seconds
+    :param quantum: The size of the pieces bytes are reserved in
+    """
+
+    def __init__(self, rate=None, burst=1.0, quantum=256 * 1024):
+        self._rate = rate
+        self.burst = burst
+        self.quantum = quantum
+        self._lock = threading.Lock()
+        self._tat = time.monotonic()
+        self.total = 0
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        with self._lock:
+            if rate != self._rate:
+                logger.info(
+                    "Transfer rate limit set to %s.",
+                    "{:.2f} MiB/s".format(rate / 1048576) if rate else "unlimited",
+                )
+            self._rate = rate or None
+            self._tat = min(self._tat, time.monotonic())
+
+    def piece(self, size):
+        """Returns the size to read or write at once, at most size, so that
+        limited transfers proceed in small steps."""
+        return min(size, self.quantum) if self._rate else size
+
+    def consume(self, n):
+        """Waits until n bytes may be transferred."""
+        with self._lock:
+            self.total += n
+        while n > 0 and self._rate:
+            piece = min(n, self.quantum)
+            n -= piece
+            with self._lock:
+                rate = self._rate
+                if not rate:
+                    return
+                now = time.monotonic()
+                start = max(self._tat, now - self.burst)
+                self._tat = start + piece / rate
+            if start > now:
+                time.sleep(start - now)
+
+
+# process-wide limits of all lookaside downloads and uploads
+download_limit = TokenBucket()
+upload_limit = TokenBucket()
+
+
+def parse_rate(text):
+    """Parses a rate such as 500K, 10M or 1G (bytes per second, binary
+    multiples) into bytes per second.  0, "", "none" and None mean no
+    limit and return None."""
+    return parse_size(text)
+
+
+def parse_size(text):
+    """Parses a size such as 500K, 10M or 1G (binary multiples) into
+    bytes.  0, "", "none" and None mean no limit and return None."""
+    if text is None:
+        return None
+    text = str(text).strip().upper()
+    if text in ("", "0", "NONE", "UNLIMITED"):
+        return None
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if text.endswith("B"):
+        text = text[:-1]
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def watch_limits(path, interval=5.0, share=1):
+    """Starts a daemon thread applying the rates of a JSON file, such as
+    {"download": "20M", "upload": "5M"}, to download_limit and
+    upload_limit whenever the file changes, so the limits can be adjusted
+    while transfers are running.  A missing key or null means no limit.
+
+    :param path: The JSON file
+    :param interval: The number of seconds between checks of the file
+    :param share: The number of processes sharing the rates, each applying
+    its part of them
+    """
+
+    def rate(text):
+        rate = parse_rate(text)
+        return max(1, rate // share) if rate else rate
+
+    def poll():
+        seen = None
+        while True:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != seen:
+                seen = mtime
+                try:
+                    with open(path, "r") as fh:
+                        limits = json.load(fh)
+                    download_limit.rate = rate(limits.get("download"))
+                    upload_limit.rate = rate(limits.get("upload"))
+                except Exception:
+                    logger.warning("Cannot apply limits from %s.", path, exc_info=True)
+            time.sleep(interval)
+
+    threading.Thread(target=poll, name="limits", daemon=True).start()
+
+
+def session():
+    """Returns the HTTP session of the calling thread, so that connections
+    to the lookaside caches are kept open and reused between requests."""
+    if not hasattr(_sessions, "session"):
+        import requests
+
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+
+def upload_session(auth="kerberos"):
+    """Returns the HTTP session of the calling thread for uploads.  Upload
+    CGIs authenticate uploaders, as pyrpkg does with GSS-Negotiate, so the
+    session carries the credentials.  They are sent with the first request
+    instead of in answer to a 401, as streamed bodies cannot be sent twice.
+
+    :param auth: "kerberos", or None for anonymous uploads
+    :raises ValueError: If the authentication method is unknown
+    """
+    if auth is None:
+        return session()
+    if auth != "kerberos":
+        raise ValueError("Unknown upload authentication {}".format(auth))
+    if not hasattr(_sessions, "upload"):
+        import requests
+        import requests_kerberos
+
+        http = requests.Session()
+        http.auth = requests_kerberos.HTTPKerberosAuth(
+            mutual_authentication=requests_kerberos.OPTIONAL,
+            force_preemptive=True,
+        )
+        _sessions.upload = http
+    return _sessions.upload
+
+
+def backoff(attempt, base=2.0, cap=120.0):
+    """Returns an exponential backoff delay with jitter.
+
+    :param attempt: The number of failed attempts so far, starting at 1
+    :param base: The delay after the first failure, in seconds
+    :param cap: The maximum delay, in seconds
+    :returns: The number of seconds to wait
+    """
+    return min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+class TransferProgress(object):
+    """Tracks the progress of a single transfer and periodically logs the
+    completed fraction and throughput.
+
+    :param label: A description of the transfer used in log messages
+    :param total: The total size of the transfer in bytes
+    :param interval: The minimum number of seconds between progress messages
+    """
+
+    def __init__(self, label, total, interval=10.0):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.sent = 0
+        self.started = time.monotonic()
+        self._logged = self.started
+
+    def update(self, done):
+        """Records the number of bytes completed so far."""
+        if done > self.done:
+            self.sent += done - self.done
+        self.done = done
+        now = time.monotonic()
+        if now - self._logged >= self.interval:
+            self._logged = now
+            logger.info(
+                "%s: %d/%d bytes (%.1f%%), %.2f MiB/s.",
+                self.label,
+                done,
+                self.total,
+                100.0 * done / self.total if self.total else 100.0,
+                self.rate() / 1048576,
+            )
+
+    def resumed(self, offset):
+        """Records that the transfer (re)started from offset.  Bytes that
+        were already present do not count towards the throughput."""
+        self.done = offset
+
+    def rate(self):
+        """Returns the average throughput in bytes per second."""
+        elapsed = time.monotonic() - self.started
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def finish(self):
+        """Logs the final transfer statistics."""
+        logger.info(
+            "%s: completed %d bytes in %.1fs, %.2f MiB/s.",
+            self.label,
+            self.total,
+            time.monotonic() - self.started,
+            self.rate() / 1048576,
+        )
+
+
+def remote_file_size(cache, name, filename, hash, hashtype):
+    """Asks the lookaside cache for the size of a file without downloading
+    it, using a HEAD request against its download URL.
+
+    :param cache: A pyrpkg CGILookasideCache instance
+    :param name: The cache name of the component, including namespace
+    :param filename: The file name
+    :param hash: The file hash
+    :param hashtype: The file hash type
+    :returns: The size in bytes, or None if it could not be determined
+    """
+    url = cache.get_download_url(name, filename, hash, hashtype)
+    try:
+        resp = session().head(url, allow_redirects=True, timeout=60)
+    except Exception:
+        logger.debug("HEAD request for %s failed.", url, exc_info=True)
+        return None
+    if resp.status_code != 200:
+        logger.debug("HEAD request for %s returned %d.", url, resp.status_code)
+        return None
+    try:
+        return int(resp.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def file_exists(cache, name, filename, hash, hashtype):
+    """Checks whether a lookaside cache has a file, using a HEAD request
+    against its download URL on the pooled session of the calling thread,
+    and the upload CGI if the answer is inconclusive.
+
+    :param cache: A pyrpkg CGILookasideCache instance
+    :param name: The cache name of the component, including namespace
+    :param filename: The file name
+    :param hash: The file hash
+    :param hashtype: The file hash type
+    :returns: True if the file exists, False otherwise
+    :raises Exception: If the cache could not be asked
+    """
+    url = cache.get_download_url(name, filename, hash, hashtype)
+    resp = session().head(url, allow_redirects=True, timeout=60)
+    if resp.status_code == 200:
+        return True
+    if resp.status_code == 404:
+        return False
+    logger.debug(
+        "HEAD request for %s returned %d, asking the CGI.", url, resp.status_code
+    )
+    cache.hashtype = hashtype
+    return cache.remote_file_exists(name, filename, hash)
+
+
+def files_exist(cache, files, workers=16):
+    """Checks many files for existence in a lookaside cache concurrently.
+    Each worker thread keeps its connections open between checks.
+
+    :param cache: A pyrpkg CGILookasideCache instance, only used to build
+    URLs and as the fallback; each worker uses its own copy for the
+    latter
+    :param files: An iterable of (name, filename, hash, hashtype) tuples
+    :param workers: The number of concurrent checks
+    :returns: A dict of the tuples to True, False, or None if the check
+    failed
+    """
+    local = threading.local()
+
+    def check(f):
+        if not hasattr(local, "cache"):
+            local.cache = copy.copy(cache)
+        try:
+            return file_exists(local.cache, *f)
+        except Exception:
+            logger.warning("Cannot check %s/%s.", f[0], f[1], exc_info=True)
+            return None
+
+    files = list(files)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(files, executor.map(check, files)))
+
+
+def _multipart(fields, filename, path, offset, length, progress):
+    """Builds a streamed multipart/form-data body that sends length bytes of
+    path starting at offset as the "file" field.  Only one chunk of the file
+    is held in memory at a time.
+
+    :returns: A (content type, content length, body iterator) tuple
+    """
+    boundary = uuid.uuid4().hex
+    head = b"".join(
+        '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(
+            boundary, k, v
+        ).encode("utf-8")
+        for k, v in fields
+    )
+    head += (
+        '--{}\r\nContent-Disposition: form-data; name="file"; '
+        'filename="{}"\r\nContent-Type: application/octet-stream\r\n\r\n'.format(
+            boundary, filename
+        ).encode("utf-8")
+    )
+    tail = "\r\n--{}--\r\n".format(boundary).encode("utf-8")
+
+    def body():
+        yield head
+        sent = 0
+        with open(path, "rb") as fh:
+            fh.seek(offset)
+            while sent < length:
+                data = fh.read(upload_limit.piece(min(CHUNK_SIZE, length - sent)))
+                if not data:
+                    raise IOError("{} shrank while uploading".format(path))
+                upload_limit.consume(len(data))
+                sent += len(data)
+                yield data
+                progress.update(offset + sent)
+        yield tail
+
+    return (
+        "multipart/form-data; boundary={}".format(boundary),
+        len(head) + length + len(tail),
+        body(),
+    )
+
+
+def _post(http, url, fields, filename, path, offset, length, progress, cert=None):
+    ctype, clen, body = _multipart(fields, filename, path, offset, length, progress)
+    resp = http.post(
+        url,
+        data=body,
+        headers={"Content-Type": ctype, "Content-Length": str(clen)},
+        cert=cert,
+        timeout=300,
+    )
+    if resp.status_code != 200:
+        raise IOError(
+            "Upload to {} failed with status {}: {}".format(
+                url, resp.status_code, resp.text.strip()
+            )
+        )
+    return resp.text.strip()
+
+
+def upload_file(
+    cache,
+    name,
+    filepath,
+    hash,
+    hashtype,
+    resumable=False,
+    chunk_size=64 * CHUNK_SIZE,
+    attempts=5,
+    auth="kerberos",
+):
+    """Uploads a file to a lookaside cache upload CGI, streaming it from
+    disk so that memory use does not depend on the file size.  Failed
+    attempts are retried with exponential backoff.
+
+    If resumable is set, the CGI is expected to accept the file in pieces:
+    a POST with a "resume" field returns the number of bytes already
+    received, and each POST with an "offset" field appends its "file"
+    content at that offset and returns the new acknowledged size.  Retries
+    then continue from the last acknowledged offset instead of starting
+    over.  Otherwise the whole file is sent in a single POST, as
+    pyrpkg does.
+
+    :param cache: The destination pyrpkg CGILookasideCache instance
+    :param name: The cache name of the component, including namespace
+    :param filepath: The file to upload
+    :param hash: The file hash
+    :param hashtype: The file hash type
+    :param resumable: Whether the CGI supports resumable uploads
+    :param chunk_size: The number of bytes sent per POST when resumable
+    :param attempts: The number of attempts before giving up
+    :param auth: The authentication of the CGI, see upload_session()
+    :raises IOError: If the upload did not complete
+    """
+    filename = os.path.basename(filepath)
+    size = os.path.getsize(filepath)
+    url = cache.upload_url
+    fields = [
+        ("name", name),
+        ("{}sum".format(hashtype), hash),
+        ("filename", filename),
+    ]
+    progress = TransferProgress("Upload of {}/{}".format(name, filename), size)
+    http = upload_session(auth)
+    cert = getattr(cache, "client_cert", None)
+    failures = 0
+    while True:
+        try:
+            if resumable:
+                resp = http.post(
+                    url, data=fields + [("resume", "1")], cert=cert, timeout=60
+                )
+                resp.raise_for_status()
+                offset = int(resp.text.strip() or 0)
+                if offset:
+                    logger.debug(
+                        "Resuming upload of %s/%s at %d/%d bytes.",
+                        name,
+                        filename,
+                        offset,
+                        size,
+                    )
+                progress.resumed(offset)
+                while offset < size:
+                    length = min(chunk_size, size - offset)
+                    acked = int(
+                        _post(
+                            http,
+                            url,
+                            fields + [("offset", str(offset))],
+                            filename,
+                            filepath,
+                            offset,
+                            length,
+                            progress,
+                            cert,
+                        )
+                    )
+                    if acked <= offset:
+                        raise IOError(
+                            "Upload of {}/{} made no progress at offset {}".format(
+                                name, filename, offset
+                            )
+                        )
+                    offset = acked
+                    # progress was made, so start backing off from scratch
+                    failures = 0
+            else:
+                progress.resumed(0)
+                _post(
+                    http, url, fields, filename, filepath, 0, size, progress, cert
+                )
+        except Exception:
+            failures += 1
+            if failures >= attempts:
+                raise
+            delay = backoff(failures)
+            logger.warning(
+                "Upload of %s/%s interrupted at %d/%d bytes, retrying in "
+                "%.1fs (attempt %d/%d).",
+                name,
+                filename,
+                progress.done,
+                size,
+                delay,
+                failures,
+                attempts,
+                exc_info=True,
+            )
+            time.sleep(delay)
+        else:
+            break
+    progress.finish()
+
+
+def download_file(cache, name, filename, hash, hashtype, outfile, attempts=5):
+    """Downloads a file from a lookaside cache, hashing it while it is
+    written, so the file is verified without being read back.  Failed
+    attempts are retried with exponential backoff.
+
+    :param cache: The source pyrpkg CGILookasideCache instance
+    :param name: The cache name of the component, including namespace
+    :param filename: The file name
+    :param hash: The expected file hash
+    :param hashtype: The file hash type
+    :param outfile: The file to write
+    :param attempts: The number of attempts before giving up
+    :returns: The number of bytes downloaded
+    :raises IOError: If the download failed or the hash did not match
+    """
+    url = cache.get_download_url(name, filename, hash, hashtype)
+    http = session()
+    failures = 0
+    while True:
+        try:
+            with http.get(url, stream=True, timeout=60) as resp:
+                resp.raise_for_status()
+                total = int(resp.headers.get("Content-Length") or 0)
+                progress = TransferProgress(
+                    "Download of {}/{}".format(name, filename), total
+                )
+                digest = hashlib.new(hashtype)
+                done = 0
+                with open(outfile, "wb") as fh:
+                    for data in resp.iter_content(download_limit.piece(CHUNK_SIZE)):
+                        download_limit.consume(len(data))
+                        digest.update(data)
+                        fh.write(data)
+                        done += len(data)
+                        progress.update(done)
+            if digest.hexdigest() != hash:
+                raise IOError(
+                    "Download of {}/{} has {} {}, expected {}".format(
+                        name, filename, hashtype, digest.hexdigest(), hash
+                    )
+                )
+        except Exception:
+            failures += 1
+            if failures >= attempts:
+                raise
+            delay = backoff(failures)
+            logger.warning(
+                "Download of %s/%s failed, retrying in %.1fs (attempt %d/%d).",
+                name,
+                filename,
+                delay,
+                failures,
+                attempts,
+                exc_info=True,
+            )
+            time.sleep(delay)
+        else:
+            break
+    progress.total = done
+    progress.finish()
+    return done
+
+
+class ContentStore(object):
+    """A local store of verified lookaside files, addressed by hash type
+    and hash.  Files only enter the store once their hash was verified, so
+    a file found in it does not need to be hashed again.  Files are
+    hard-linked in and out where possible.
+
+    :param root: The store directory
+    :param budget: The disk budget in bytes, or None for no limit; see
+    prune()
+    """
+
+    def __init__(self, root, budget=None):
+        self.root = root
+        self.budget = budget
+
+    def path(self, filename, hash, hashtype):
+        """Returns the path of a file in the store, present or not."""
+        return os.path.join(self.root, hashtype, hash[:2], hash, filename)
+
+    def get(self, filename, hash, hashtype):
+        """Returns the path of a stored file, or None if it is not stored."""
+        path = self.path(filename, hash, hashtype)
+        if not os.path.isfile(path):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def put(self, src, filename, hash, hashtype):
+        """Adds a verified file to the store.
+
+        :param src: The file, already verified against hash
+        :param filename: The file name
+        :param hash: The file hash
+        :param hashtype: The file hash type
+        :returns: The path of the stored file
+        """
+        path = self.path(filename, hash, hashtype)
+        if os.path.isfile(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpname = "{}.{}".format(path, uuid.uuid4().hex)
+        try:
+            os.link(src, tmpname)
+        except OSError:
+            shutil.copyfile(src, tmpname)
+        os.replace(tmpname, path)
+        return path
+
+    def prune(self):
+        """Removes the least recently used files until the store is within
+        its budget.
+
+        :returns: The number of files removed
+        """
+        if self.budget is None or not os.path.isdir(self.root):
+            return 0
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.budget:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+class SizeIndex(object):
+    """A persistent index of lookaside file sizes, plus the total size of
+    the source files last seen for each component.  Used to schedule the
+    largest transfers and components first.  Safe to share between threads.
+
+    :param path: The JSON file backing the index, or None to keep the
+    index in memory only; it is only read on first use
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = {}
+        self._comps = {}
+        self._loaded = False
+
+    def _load(self):
+        # called with the lock held
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.path and os.path.isfile(self.path):
+            try:
+                with open(self.path, "r") as fh:
+                    data = json.load(fh)
+                self._files = data.get("files", {})
+                self._comps = data.get("comps", {})
+            except Exception:
+                logger.warning("Cannot read size index %s, ignoring.", self.path)
+
+    def get(self, name, filename, hash):
+        """Returns the recorded size of a file, or None if unknown."""
+        with self._lock:
+            self._load()
+            return self._files.get("{}/{}/{}".format(name, filename, hash))
+
+    def set(self, name, filename, hash, size):
+        """Records the size of a file."""
+        with self._lock:
+            self._load()
+            self._files["{}/{}/{}".format(name, filename, hash)] = size
+
+    def component_total(self, ns, comp):
+        """Returns the total source size last recorded for a component, or
+        0 if unknown."""
+        with self._lock:
+            self._load()
+            return self._comps.get("{}/{}".format(ns, comp), 0)
+
+    def set_component_total(self, ns, comp, size):
+        """Records the total source size of a component."""
+        with self._lock:
+            self._load()
+            self._comps["{}/{}".format(ns, comp)] = size
+
+    def save(self):
+        """Atomically writes the index back to its JSON file."""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._loaded:
+                # nothing was recorded, keep the file as it is
+                return
+            data = {"files": dict(self._files), "comps": dict(self._comps)}
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".sizes-")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(data, fh)
+        os.replace(tmpname, self.path)
+
+
+class SourcesIndex(object):
+    """A persistent cache of parsed sources files, keyed by the git object
+    id of the file, so that a sources file shared by several streams or
+    unchanged between runs is only parsed once.  Safe to share between
+    threads.
+
+    :param path: The JSON file backing the cache, or None to keep it in
+    memory only; it is only read on first use
+    :param limit: The number of sources files kept; the oldest entries are
+    dropped first
+    """
+
+    def __init__(self, path=None, limit=100000):
+        self.path = path
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._parsed = {}
+        self._changed = False
+        self._loaded = False
+
+    def _load(self):
+        # called with the lock held
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.path and os.path.isfile(self.path):
+            try:
+                with open(self.path, "r") as fh:
+                    self._parsed = json.load(fh)
+            except Exception:
+                logger.warning("Cannot read sources index %s, ignoring.", self.path)
+
+    def get(self, oid):
+        """Returns the parsed sources file with the given object id, as a
+        set of (filename, hash, hashtype) tuples, or None if unknown."""
+        with self._lock:
+            self._load()
+            entries = self._parsed.get(oid)
+        if entries is None:
+            return None
+        return {tuple(e) for e in entries}
+
+    def set(self, oid, sources):
+        """Records a parsed sources file."""
+        with self._lock:
+            self._load()
+            if oid in self._parsed:
+                return
+            self._parsed[oid] = sorted(list(s) for s in sources)
+            while len(self._parsed) > self.limit:
+                del self._parsed[next(iter(self._parsed))]
+            self._changed = True
+
+    def save(self):
+        """Atomically writes the cache back to its JSON file, if it
+        changed."""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._changed:
+                return
+            data = dict(self._parsed)
+            self._changed = False
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".sources-")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(data, fh, separators=(",", ":"))
+        os.replace(tmpname, self.path)
+
+
+class TransferScheduler(object):
+    """A pool of worker threads that always runs the largest pending
+    transfer next, regardless of which component submitted it.  Starting
+    the big files first keeps the tail of a run short.
+
+    Worker threads are started on the first submission, so the number of
+    workers may be changed until then.  Transfers run in a copy of the
+    context variables of the submitting thread.
+
+    :param workers: The number of concurrent transfers
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, size, fn, *args, **kwargs):
+        """Queues a transfer.
+
+        :param size: The expected size of the transfer in bytes, used for
+        ordering; larger transfers are started first
+        :param fn: The callable performing the transfer
+        :returns: A concurrent.futures.Future for the result of fn
+        """
+        future = concurrent.futures.Future()
+        with self._cond:
+            if not self._threads:
+                for i in range(max(1, self.workers)):
+                    t = threading.Thread(
+                        target=self._worker,
+                        name="transfer-{}".format(i),
+                        daemon=True,
+                    )
+                    t.start()
+                    self._threads.append(t)
+            heapq.heappush(
+                self._heap,
+                (
+                    -(size or 0),
+                    next(self._counter),
+                    future,
+                    contextvars.copy_context(),
+                    fn,
+                    args,
+                    kwargs,
+                ),
+            )
+            self._cond.notify()
+        return future
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, future, ctx, fn, args, kwargs = heapq.heappop(self._heap)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(ctx.run(fn, *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
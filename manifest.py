@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+# Compiled component manifests.
+#
+# Component list files are resolved once into the source and destination
+# scm, repository directory and cache names of each entry, deduplicated
+# and grouped by repository, and cached as compact JSON keyed by the list
+# contents and the configuration, so later runs load them without
+# resolving anything.
+#
+# Usage: manifest.py manifest.json
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# bumped whenever the compiled entries change shape, so that stale cached
+# manifests are compiled again
+VERSION = 1
+
+
+def read_list(path):
+    """Reads a component list file, skipping blank lines and comments."""
+    with open(path, "r") as fh:
+        return [
+            line.strip()
+            for line in fh
+            if line.strip() and not line.strip().startswith("#")
+        ]
+
+
+def fingerprint(recs, config):
+    """Returns the cache key of a manifest: a hash of its entries and of
+    everything their resolution depends on.
+
+    :param recs: The list entries, in order
+    :param config: A JSON serializable description of the configuration
+    """
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps([VERSION, recs, config], sort_keys=True, default=str).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """The resolved, deduplicated entries of one or more component lists.
+
+    Entries are dicts as returned by the resolver, with the original list
+    entry added as "rec".  Entries resolving to the same namespace,
+    component and ref are only kept once.  Groups map each repository
+    directory to the indexes of the entries using it, such as the same
+    rpm component imported for several streams, so that they can be
+    imported one after the other by a single worker.
+
+    :param entries: The list of entries
+    :param duplicates: The number of dropped duplicate list entries
+    """
+
+    def __init__(self, entries, duplicates=0):
+        self.entries = entries
+        self.duplicates = duplicates
+        self.groups = {}
+        for i, entry in enumerate(entries):
+            self.groups.setdefault(entry["gitdir"], []).append(i)
+
+    @classmethod
+    def compile(cls, recs, resolve):
+        """Resolves list entries into a manifest.
+
+        :param recs: The list entries, in order
+        :param resolve: A callable resolving one entry into a dict with at
+        least ns, comp, ref and gitdir keys, raising ValueError or KeyError
+        on invalid entries
+        :returns: The Manifest
+        :raises ValueError: If an entry cannot be resolved
+        """
+        entries = []
+        seen = set()
+        duplicates = 0
+        for rec in recs:
+            try:
+                entry = resolve(rec)
+            except (KeyError, ValueError) as e:
+                raise ValueError("Cannot resolve {}: {}".format(rec, e))
+            key = (entry["ns"], entry["comp"], entry["ref"])
+            if key in seen:
+                logger.debug("Dropping duplicate entry %s.", rec)
+                duplicates += 1
+                continue
+            seen.add(key)
+            entry["rec"] = rec
+            entries.append(entry)
+        return cls(entries, duplicates)
+
+    def dump(self, fh):
+        """Writes the manifest as compact JSON: the field names once, then
+        one row of values per entry."""
+        fields = sorted({k for entry in self.entries for k in entry})
+        json.dump(
+            {
+                "version": VERSION,
+                "duplicates": self.duplicates,
+                "fields": fields,
+                "rows": [[entry.get(k) for k in fields] for entry in self.entries],
+            },
+            fh,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def load(cls, fh):
+        """Reads a manifest written by dump().
+
+        :raises ValueError: If it is not a manifest of this version
+        """
+        data = json.load(fh)
+        if data.get("version") != VERSION:
+            raise ValueError("Unsupported manifest version")
+        fields = data["fields"]
+        return cls([dict(zip(fields, row)) for row in data["rows"]], data["duplicates"])
+
+
+def load(paths, config, resolve, cache_dir=None):
+    """Returns the manifest of component list files, from the cache if it
+    was compiled before with the same lists and configuration.
+
+    :param paths: The component list files
+    :param config: A JSON serializable description of the configuration
+    the entries are resolved with
+    :param resolve: The resolver, see Manifest.compile()
+    :param cache_dir: The directory compiled manifests are cached in, or
+    None to not cache them
+    :returns: The Manifest
+    :raises ValueError: If an entry cannot be resolved
+    """
+    recs = []
+    for path in paths:
+        recs += read_list(path)
+    key = fingerprint(recs, config)
+    cached = os.path.join(cache_dir, key + ".json") if cache_dir else None
+    if cached and os.path.isfile(cached):
+        try:
+            with open(cached, "r") as fh:
+                m = Manifest.load(fh)
+            logger.debug("Loaded manifest %s.", cached)
+            return m
+        except Exception:
+            logger.warning("Cannot read manifest %s, compiling.", cached)
+    m = Manifest.compile(recs, resolve)
+    logger.info(
+        "Compiled %d entries into %d component(s) in %d repositories, "
+        "dropped %d duplicate(s).",
+        len(recs),
+        len(m.entries),
+        len(m.groups),
+        m.duplicates,
+    )
+    if cached:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=cache_dir, prefix=".manifest-")
+            with os.fdopen(fd, "w") as fh:
+                m.dump(fh)
+            os.replace(tmpname, cached)
+        except Exception:
+            logger.warning("Cannot write manifest %s.", cached, exc_info=True)
+    return m
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show a compiled manifest.")
+    parser.add_argument("manifest", help="The compiled manifest file")
+    args = parser.parse_args()
+
+    with open(args.manifest, "r") as fh:
+        m = Manifest.load(fh)
+    for gitdir, indexes in sorted(m.groups.items()):
+        print(gitdir)
+        for i in indexes:
+            entry = m.entries[i]
+            print("    {}/{}#{}".format(entry["ns"], entry["comp"], entry["ref"]))
+    print(
+        "Total: {} component(s), {} repositories, {} duplicate(s) dropped".format(
+            len(m.entries), len(m.groups), m.duplicates
+        )
+    )
@@ -1,10 +1,21 @@
 #!/usr/bin/python
 
+import argparse
+import concurrent.futures
+import itertools
 import json
+import os
+import re
 import requests
+import sys
+import threading
+import time
 
 dry_run = True
 
+# local record of submitted builds, used to avoid duplicate submissions
+submissions = os.path.expanduser("~/.cache/stream-module-testing/mbs-submissions.json")
+
 c = {
     "main": {
         "build": {
@@ -21,27 +32,246 @@ c = {
 }
 
 
-def request_module_build(scmurl, branch):
+_submissions_lock = threading.Lock()
+
+# build states after which a build does not change any more
+final_states = ("ready", "failed", "garbage")
+
+
+class Session(object):
+    """One authenticated connection to MBS, shared by all the requests of
+    a run, including concurrent ones.  With kerberos, the authentication
+    is attached to a requests session; with oidc, the token is kept by one
+    OpenID client.
+    """
+
+    def __init__(self):
+        mbs = c["main"]["destination"]["mbs"]
+        self.http = requests.Session()
+        self.oidc = None
+        if mbs["auth_method"] == "kerberos":
+            import requests_kerberos
+
+            self.http.auth = requests_kerberos.HTTPKerberosAuth(
+                mutual_authentication=requests_kerberos.OPTIONAL,
+            )
+        elif mbs["auth_method"] == "oidc":
+            import openidc_client
+
+            if (
+                mbs["oidc_id_provider"] is None
+                or mbs["oidc_client_id"] is None
+                or mbs["oidc_scopes"] is None
+            ):
+                raise ValueError(
+                    "The selected authentication method was "
+                    '"oidc" but the OIDC configuration keyword '
+                    "arguments were not specified"
+                )
+            mapping = {"Token": "Token", "Authorization": "Authorization"}
+            # Get the auth token using the OpenID client
+            self.oidc = openidc_client.OpenIDCClient(
+                "mbs_build",
+                mbs["oidc_id_provider"],
+                mapping,
+                mbs["oidc_client_id"],
+                mbs["oidc_client_secret"],
+            )
+        else:
+            raise ValueError("Unknown MBS auth_method {}".format(mbs["auth_method"]))
+
+
+def submission_key(scmurl, branch, platform, scratch):
+    return "{}|{}|{}|{}".format(scmurl, branch, platform, "scratch" if scratch else "")
+
+
+def load_submissions():
+    """Returns the local record of submitted builds, keyed by
+    submission_key()."""
+    if not os.path.isfile(submissions):
+        return {}
+    try:
+        with open(submissions, "r") as fh:
+            return json.load(fh)
+    except Exception:
+        print("Cannot read {}, ignoring.".format(submissions))
+        return {}
+
+
+def record_submission(scmurl, branch, platform, scratch, build_id):
+    """Adds a submitted build to the local record."""
+    with _submissions_lock:
+        subs = load_submissions()
+        subs[submission_key(scmurl, branch, platform, scratch)] = {
+            "id": build_id,
+            "submitted": int(time.time()),
+        }
+        os.makedirs(os.path.dirname(submissions), exist_ok=True)
+        tmpname = "{}.{}".format(submissions, os.getpid())
+        with open(tmpname, "w") as fh:
+            json.dump(subs, fh, indent=2)
+        os.replace(tmpname, submissions)
+
+
+def drop_submission(scmurl, branch, platform, scratch):
+    """Removes a submitted build from the local record."""
+    with _submissions_lock:
+        subs = load_submissions()
+        if subs.pop(submission_key(scmurl, branch, platform, scratch), None) is None:
+            return
+        tmpname = "{}.{}".format(submissions, os.getpid())
+        with open(tmpname, "w") as fh:
+            json.dump(subs, fh, indent=2)
+        os.replace(tmpname, submissions)
+
+
+def build_state(build_id, session=None):
+    """Returns the state name of a build, such as "build" or "ready".
+
+    :param session: The Session to use, or None for a new connection
+    :raises requests.RequestException: If MBS cannot be asked
+    """
+    http = session.http if session else requests
+    request_url = "{}/{}/{}".format(
+        c["main"]["destination"]["mbs"]["api_url"].rstrip("/"),
+        "module-builds",
+        build_id,
+    )
+    resp = http.get(request_url, timeout=60)
+    resp.raise_for_status()
+    return resp.json().get("state_name")
+
+
+def find_existing_build(scmurl, branch, platform, scratch, session=None):
+    """Asks MBS for a build of the same commit, stream, platform and
+    scratch setting that has not failed.  Only scmurls pinned to a commit
+    hash are looked up; a branch name does not tell which builds are of
+    the same content.
+
+    :param session: The Session to use, or None for a new connection
+    :returns: The id of a matching build, or None
+    """
+    name = scmurl.split("?")[0].split("#")[0].rstrip("/").split("/")[-1]
+    if name.endswith(".git"):
+        name = name[: -len(".git")]
+    commit = scmurl.split("#")[-1] if "#" in scmurl else ""
+    if not re.match(r"^[0-9a-f]{40}$", commit):
+        return None
+    request_url = "{}/{}/".format(
+        c["main"]["destination"]["mbs"]["api_url"], "module-builds"
+    )
+    params = {
+        "name": name,
+        "stream": branch,
+        "verbose": "true",
+        "per_page": 100,
+        "order_desc_by": "id",
+    }
+    http = session.http if session else requests
+    resp = http.get(request_url, params=params, timeout=60)
+    resp.raise_for_status()
+    for build in resp.json().get("items", []):
+        if build.get("state_name") in ("failed", "garbage"):
+            continue
+        if bool(build.get("scratch")) != bool(scratch):
+            continue
+        if not (build.get("scmurl") or "").endswith("#" + commit):
+            continue
+        brs = build.get("buildrequires") or {}
+        if brs.get("platform", {}).get("stream") not in (None, platform):
+            continue
+        return build["id"]
+    return None
+
+
+def submit_module_build(
+    scmurl, branch, force=False, check_existing=True, platform=None, session=None
+):
+    """Submits a module build unless the same commit, branch, platform
+    override and scratch setting was already submitted.
+
+    :param scmurl: The module scmurl, including the commit
+    :param branch: The module stream branch
+    :param force: Submit even if a matching build exists
+    :param check_existing: Also ask MBS for matching builds that are not in
+    the local record
+    :param platform: The platform stream to build against, defaults to the
+    configured one
+    :param session: The Session to submit through, or None for a new one
+    :returns: A list of build ids, which may be empty in dry run mode
+    """
+    platform = platform if platform else c["main"]["build"]["platform"]
+    scratch = c["main"]["build"]["scratch"]
+    if not force:
+        prev = load_submissions().get(
+            submission_key(scmurl, branch, platform, scratch)
+        )
+        if prev:
+            try:
+                state = build_state(prev["id"], session=session)
+            except Exception as e:
+                # trust the record rather than risk a duplicate build
+                print("Cannot get the state of build {}: {}".format(prev["id"], e))
+                state = None
+            if state in ("failed", "garbage"):
+                print(
+                    "Previously submitted build {} is {}, resubmitting.".format(
+                        prev["id"], state
+                    )
+                )
+                drop_submission(scmurl, branch, platform, scratch)
+            else:
+                print(
+                    "Already submitted as build {}, not resubmitting.".format(prev["id"])
+                )
+                return [prev["id"]]
+        if check_existing:
+            build_id = find_existing_build(
+                scmurl, branch, platform, scratch, session=session
+            )
+            if build_id is not None:
+                print("Found existing build {}, not resubmitting.".format(build_id))
+                if not dry_run:
+                    record_submission(scmurl, branch, platform, scratch, build_id)
+                return [build_id]
+    resp = request_module_build(scmurl, branch, platform=platform, session=session)
+    data = resp.json()
+    builds = data if isinstance(data, list) else [data]
+    ids = [b["id"] for b in builds if "id" in b]
+    if not dry_run:
+        for build_id in ids:
+            record_submission(scmurl, branch, platform, scratch, build_id)
+    return ids
+
+
+def request_module_build(scmurl, branch, platform=None, session=None):
+    """Posts a module build request.
+
+    :param scmurl: The module scmurl, including the commit
+    :param branch: The module stream branch
+    :param platform: The platform stream to build against, defaults to the
+    configured one
+    :param session: The Session to post through, or None for a new one
+    :returns: The response
+    """
     body = {
         "scmurl": scmurl,
         "branch": branch,
         "buildrequire_overrides": {
-            "platform": [c["main"]["build"]["platform"]]
+            "platform": [platform if platform else c["main"]["build"]["platform"]]
         },
         "scratch": c["main"]["build"]["scratch"],
     }
 
     request_url = "{}/{}/".format(c["main"]["destination"]["mbs"]["api_url"], "module-builds")
 
-    if c["main"]["destination"]["mbs"]["auth_method"] == "kerberos":
-        import requests_kerberos
+    if session is None:
+        session = Session()
 
+    if session.oidc is None:
         data = json.dumps(body)
-        auth = requests_kerberos.HTTPKerberosAuth(
-            mutual_authentication=requests_kerberos.OPTIONAL,
-        )
         if not dry_run:
-            resp = requests.post(request_url, data=data, auth=auth)
+            resp = session.http.post(request_url, data=data)
             if resp.status_code == 401:
                 raise ValueError(
                     "MBS authentication using Kerberos failed. "
@@ -55,31 +285,9 @@ def request_module_build(scmurl, branch):
             resp = requests.Response()
             resp.__setstate__({"_content": b"{}"})
 
-    elif c["main"]["destination"]["mbs"]["auth_method"] == "oidc":
-        import openidc_client
-
-        if (
-            c["main"]["destination"]["mbs"]["oidc_id_provider"] is None
-            or c["main"]["destination"]["mbs"]["oidc_client_id"] is None
-            or c["main"]["destination"]["mbs"]["oidc_scopes"] is None
-        ):
-            raise ValueError(
-                "The selected authentication method was "
-                '"oidc" but the OIDC configuration keyword '
-                "arguments were not specified"
-            )
-
-        mapping = {"Token": "Token", "Authorization": "Authorization"}
-        # Get the auth token using the OpenID client
-        oidc = openidc_client.OpenIDCClient(
-            "mbs_build",
-            c["main"]["destination"]["mbs"]["oidc_id_provider"],
-            mapping,
-            c["main"]["destination"]["mbs"]["oidc_client_id"],
-            c["main"]["destination"]["mbs"]["oidc_client_secret"],
-        )
+    else:
         if not dry_run:
-            resp = oidc.send_request(
+            resp = session.oidc.send_request(
                 request_url,
                 http_method="POST",
                 json=body,
@@ -98,19 +306,238 @@ def request_module_build(scmurl, branch):
             resp = requests.Response()
             resp.__setstate__({"_content": b"{}"})
 
-    else:
-        raise ValueError(
-            "Unknown MBS auth_method {}".format(
-                c["main"]["destination"]["mbs"]["auth_method"]
-            )
-        )
-
     print("resp: {}".format(resp))
     print("resp.text: {}".format(resp.text))
     print("resp.json(): {}".format(resp.json()))
+    return resp
+
+
+def submit_matrix(
+    streams, platforms, force=False, check_existing=True, workers=4, session=None
+):
+    """Submits the builds of several module streams against several
+    platform streams concurrently, through one session.
+
+    :param streams: A list of (scmurl, branch) tuples
+    :param platforms: A list of platform streams
+    :param force: Submit even if a matching build exists
+    :param check_existing: Also ask MBS for matching builds that are not in
+    the local record
+    :param workers: The number of concurrent submissions
+    :param session: The Session to submit through, or None for a new one
+    :returns: A dict of (scmurl, branch, platform) tuples to lists of build
+    ids, or to None if the submission failed
+    """
+    session = session if session else Session()
+    matrix = [
+        (scmurl, branch, platform)
+        for (scmurl, branch), platform in itertools.product(streams, platforms)
+    ]
+    builds = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                submit_module_build,
+                scmurl,
+                branch,
+                force=force,
+                check_existing=check_existing,
+                platform=platform,
+                session=session,
+            ): (scmurl, branch, platform)
+            for scmurl, branch, platform in matrix
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                builds[futures[future]] = future.result()
+            except Exception as e:
+                print("Cannot submit {} {} for {}: {}".format(*futures[future], e))
+                builds[futures[future]] = None
+    return builds
+
+
+def wait_for_builds(ids, interval=60, session=None, max_failures=5, timeout=None):
+    """Polls the state of builds until all of them are finished, printing
+    their state changes.  Builds whose state cannot be fetched
+    max_failures times in a row, or that are still pending when the
+    timeout expires, are given up on and reported as "unknown".
 
+    :param ids: The build ids
+    :param interval: The number of seconds between polls
+    :param session: The Session to use, or None for a new connection
+    :param max_failures: The number of consecutive failed polls of a build
+    before giving up on it
+    :param timeout: The number of seconds to wait at most, or None
+    :returns: A dict of build ids to their final state names
+    """
+    states = {}
+    failures = {}
+    pending = set(ids)
+    deadline = time.monotonic() + timeout if timeout else None
+    while pending:
+        for build_id in sorted(pending):
+            try:
+                state = build_state(build_id, session=session)
+            except Exception as e:
+                print("Cannot get the state of build {}: {}".format(build_id, e))
+                failures[build_id] = failures.get(build_id, 0) + 1
+                if failures[build_id] >= max_failures:
+                    print("Giving up on build {}.".format(build_id))
+                    states[build_id] = "unknown"
+                    pending.discard(build_id)
+                continue
+            failures[build_id] = 0
+            if state != states.get(build_id):
+                print("Build {}: {}".format(build_id, state))
+                states[build_id] = state
+            if state in final_states:
+                pending.discard(build_id)
+        if pending and deadline is not None and time.monotonic() >= deadline:
+            for build_id in sorted(pending):
+                print("Timed out waiting for build {}.".format(build_id))
+                states[build_id] = "unknown"
+            break
+        if pending:
+            time.sleep(interval)
+    return states
 
-request_module_build(
-    "https://gitlab.com/redhat/centos-stream/temp/container-tools.git?#5c6b8b9e1b886c0397326f68aaedb3e0e4112205",
-    "3.0-rhel-9.0.0-beta",
-)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit a module build to MBS.")
+    parser.add_argument(
+        "scmurl",
+        nargs="?",
+        help="The module scmurl, including the commit",
+        default="https://gitlab.com/redhat/centos-stream/temp/container-tools.git?#5c6b8b9e1b886c0397326f68aaedb3e0e4112205",
+    )
+    parser.add_argument(
+        "branch",
+        nargs="?",
+        help="The module stream branch",
+        default="3.0-rhel-9.0.0-beta",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Submit even if the same build was already submitted",
+        default=False,
+    )
+    parser.add_argument(
+        "--no-check-existing",
+        dest="check_existing",
+        action="store_false",
+        help="Do not ask MBS for existing builds of the same commit",
+        default=True,
+    )
+
+    parser.add_argument(
+        "-P",
+        "--platform",
+        action="append",
+        help="A platform stream to build against; may be given more than "
+        "once to build against each of them",
+        default=[],
+    )
+    parser.add_argument(
+        "--stream",
+        nargs=2,
+        action="append",
+        metavar=("SCMURL", "BRANCH"),
+        help="A module scmurl and stream branch to build, instead of the "
+        "positional ones; may be given more than once",
+        default=[],
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of builds to submit concurrently",
+        default=4,
+    )
+    parser.add_argument(
+        "-w",
+        "--wait",
+        action="store_true",
+        help="Wait for the submitted builds to finish",
+        default=False,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        metavar="SECONDS",
+        help="Stop waiting for the builds after SECONDS",
+        default=None,
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        metavar="SECONDS",
+        help="Seconds between build state polls while waiting",
+        default=60,
+    )
+
+    args = parser.parse_args()
+
+    if args.platform or args.stream or args.wait:
+        streams = [tuple(s) for s in args.stream] or [(args.scmurl, args.branch)]
+        platforms = args.platform or [c["main"]["build"]["platform"]]
+        session = Session()
+        started = time.monotonic()
+        builds = submit_matrix(
+            streams,
+            platforms,
+            force=args.force,
+            check_existing=args.check_existing,
+            workers=args.jobs,
+            session=session,
+        )
+        for scmurl, branch, platform in sorted(builds):
+            ids = builds[(scmurl, branch, platform)]
+            print(
+                "{} {} on {}: {}".format(
+                    scmurl,
+                    branch,
+                    platform,
+                    "failed" if ids is None else "build ids {}".format(ids),
+                )
+            )
+        failed = [k for k, ids in builds.items() if ids is None]
+        ok = not failed
+        print(
+            "Submitted {} of {} build request(s) in {:.1f}s.".format(
+                len(builds) - len(failed), len(builds), time.monotonic() - started
+            )
+        )
+        if args.wait:
+            states = wait_for_builds(
+                [i for ids in builds.values() if ids for i in ids],
+                interval=args.interval,
+                session=session,
+                timeout=args.timeout,
+            )
+            ready = [i for i, state in states.items() if state == "ready"]
+            unknown = [i for i, state in states.items() if state == "unknown"]
+            print(
+                "Matrix of {} build(s) finished in {:.1f}s, {} ready, {} failed, "
+                "{} unknown.".format(
+                    len(states),
+                    time.monotonic() - started,
+                    len(ready),
+                    len(states) - len(ready) - len(unknown),
+                    len(unknown),
+                )
+            )
+            ok = ok and len(ready) == len(states)
+        sys.exit(0 if ok else 1)
+
+    print(
+        "Build ids: {}".format(
+            submit_module_build(
+                args.scmurl,
+                args.branch,
+                force=args.force,
+                check_existing=args.check_existing,
+            )
+        )
+    )
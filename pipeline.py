@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+
+# Usage: pipeline.py [--stream components.txt module.txt [config.py]] [ ... ]
+#
+# Imports the rpm components of each stream, then the module, then submits
+# the module build to MBS, with the streams progressing concurrently.
+
+import argparse
+import concurrent.futures
+import importlib
+import importlib.util
+import logging
+import os
+import sys
+import time
+
+importer = importlib.import_module("import-components")
+import history
+import logsink
+import manifest
+import mbs
+import profiling
+import progress
+
+logger = logging.getLogger("pipeline")
+
+# the streams processed when none are given on the command line, as
+# (rpm components list, module list, configuration script) tuples; None
+# uses the configuration of import-components.py
+streams = [
+    ("container-tools-components-3.0.txt", "container-tools-module-3.0.txt", None),
+    (
+        "container-tools-components-latest.txt",
+        "container-tools-module-latest.txt",
+        None,
+    ),
+]
+
+# anonymous clone URL prefix MBS uses for the destination scm
+mbs_scm = ("ssh://git@gitlab.com/", "https://gitlab.com/")
+
+
+def load_job(script):
+    """Returns the import job defined by a configuration script such as
+    import-components-container-tools-c9s-3.0.py, or the default job if
+    script is None."""
+    if script is None:
+        return importer.default_job()
+    path = script if script.endswith(".py") else script + ".py"
+    if not os.path.isfile(path):
+        # relative to this script, where the configuration scripts live
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    # loaded by path, as names such as the one of the 3.0 script are not
+    # valid module names
+    name = os.path.basename(path)[: -len(".py")]
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None:
+        raise ImportError("Cannot load configuration script {}".format(script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.job
+
+
+def run_stream(executor, pushes, rpms, modules, job):
+    """Runs the import and build stages of one stream.  The rpm components
+    are imported concurrently on the shared executor; the module is only
+    imported once all of them succeeded, and its build is submitted from
+    the exact commit that was pushed.
+
+    :param executor: The executor component imports run on
+    :param pushes: The importer.PushQueue pushes run on
+    :param rpms: The list of rpm components to import
+    :param modules: The list of modules to import and build
+    :param job: The import job
+    :returns: A dict of module names to lists of MBS build ids, or None if
+    a stage failed
+    """
+    started = time.monotonic()
+    futures = {
+        executor.submit(
+            importer.import_component, importer.split_scmurl(rec), job, pushes
+        ): rec
+        for rec in rpms
+    }
+    failed = []
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            if importer.PushQueue.outcome(future.result()) is None:
+                failed.append(futures[future])
+        except Exception:
+            logger.error(
+                "Unexpected error importing %s.", futures[future], exc_info=True
+            )
+            failed.append(futures[future])
+    if failed:
+        logger.error(
+            "Failed to import %d rpm component(s) for %s, not importing the "
+            "module: %s",
+            len(failed),
+            ", ".join(modules),
+            ", ".join(sorted(failed)),
+        )
+        return None
+    logger.info(
+        "Imported %d rpm component(s) for %s in %.1fs.",
+        len(rpms),
+        ", ".join(modules),
+        time.monotonic() - started,
+    )
+
+    builds = {}
+    for rec in modules:
+        dscm = importer.PushQueue.outcome(
+            executor.submit(
+                importer.import_component, importer.split_scmurl(rec), job, pushes
+            ).result()
+        )
+        if dscm is None:
+            logger.error("Failed to import module %s, not building.", rec)
+            return None
+        scmurl = "{}?#{}".format(
+            dscm["link"].replace(mbs_scm[0], mbs_scm[1], 1), dscm["commit"]
+        )
+        logger.info("Submitting module build of %s#%s.", scmurl, dscm["ref"])
+        builds[rec] = mbs.submit_module_build(scmurl, dscm["ref"])
+    logger.info(
+        "Stream %s completed in %.1fs.",
+        ", ".join(modules),
+        time.monotonic() - started,
+    )
+    return builds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import rpm components and modules, then build the modules."
+    )
+    parser.add_argument(
+        "--stream",
+        nargs="+",
+        action="append",
+        metavar="FILE",
+        help="The component and module list files of a stream, optionally "
+        "followed by the configuration script to import it with",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of components to import concurrently",
+        default=4,
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Count and time the git commands and HTTP requests, including "
+        "the MBS ones, and write a report of the most expensive ones",
+        default=False,
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Do not upload, push or submit builds",
+        default=False,
+    )
+
+    args = parser.parse_args()
+
+    rundir = os.path.join(
+        importer.log_dir, "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+    )
+    logsink.setup(rundir)
+    if args.profile:
+        profiling.install()
+    importer.dry_run = args.dry_run
+    mbs.dry_run = args.dry_run
+    importer.run = history.History(importer.history_db).start_run(
+        sys.argv[0], sys.argv[1:]
+    )
+
+    specs = []
+    for spec in args.stream or streams:
+        if len(spec) not in (2, 3):
+            parser.error("--stream takes COMPONENTS MODULES [CONFIG]")
+        job = load_job(spec[2] if len(spec) == 3 else None)
+        if args.dry_run:
+            job.dry_run = True
+        specs.append((spec[0], spec[1], job))
+
+    lists = [
+        (manifest.read_list(spec[0]), manifest.read_list(spec[1]), spec[2])
+        for spec in specs
+    ]
+    progress.tracker.add(sum(len(rpms) + len(modules) for rpms, modules, _ in lists))
+    reporter = progress.Reporter(os.path.join(rundir, "status.json")).start()
+
+    pushes = importer.PushQueue(importer.push_workers)
+    started = time.monotonic()
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(specs)) as streamer:
+            futures = {
+                streamer.submit(run_stream, executor, pushes, *spec): spec[1]
+                for spec in lists
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    builds = future.result()
+                except Exception:
+                    logger.error(
+                        "Unexpected error running stream %s.",
+                        ", ".join(futures[future]),
+                        exc_info=True,
+                    )
+                    failed += 1
+                    continue
+                if builds is None:
+                    logger.error("Stream %s failed.", ", ".join(futures[future]))
+                    failed += 1
+                else:
+                    for rec, ids in builds.items():
+                        logger.info("Module %s builds: %s", rec, ids)
+    pushes.shutdown()
+    reporter.stop()
+    importer.run.finish()
+    importer.save_sources_index()
+    importer.write_profile(rundir)
+    logger.info(
+        "Pipeline completed in %.1fs, %d of %d stream(s) failed.",
+        time.monotonic() - started,
+        failed,
+        len(lists),
+    )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+
+# Call accounting for the import scripts.
+#
+# Counts and times the git commands, lookaside cache operations and HTTP
+# requests made while importing, per component, and optionally captures
+# cProfile data of each component import.
+
+import contextlib
+import cProfile
+import functools
+import heapq
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+import urllib.parse
+
+import logsink
+
+logger = logging.getLogger(__name__)
+
+# the number of most expensive single calls kept for the report
+slowest_calls = 25
+
+
+class Profiler(object):
+    """Collects the number and duration of calls per component, kind and
+    operation.  Safe to share between threads."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slowest = []
+
+    def record(self, kind, op, duration, detail=None):
+        """Records a finished call.
+
+        :param kind: The kind of call, "git", "http" or "lookaside"
+        :param op: The operation, such as the git subcommand
+        :param duration: The duration in seconds
+        :param detail: A description of the single call for the report
+        """
+        comp = logsink.component.get() or "-"
+        with self._lock:
+            entry = self._stats.setdefault((comp, kind, op), [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+            item = (duration, comp, kind, detail or op)
+            if len(self._slowest) < slowest_calls:
+                heapq.heappush(self._slowest, item)
+            else:
+                heapq.heappushpop(self._slowest, item)
+
+    @contextlib.contextmanager
+    def timed(self, kind, op, detail=None):
+        """Records the call made within the context."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(kind, op, time.monotonic() - started, detail)
+
+    def report(self, fh):
+        """Writes the ranked report of the calls made so far.
+
+        :param fh: The file to write to
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            slowest = sorted(self._slowest, reverse=True)
+        ops = {}
+        comps = {}
+        for (comp, kind, op), (count, total, longest) in stats.items():
+            entry = ops.setdefault((kind, op), [0, 0.0, 0.0])
+            entry[0] += count
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+            entry = comps.setdefault(comp, {})
+            entry[kind] = [
+                entry.get(kind, [0, 0.0])[0] + count,
+                entry.get(kind, [0, 0.0])[1] + total,
+            ]
+        fh.write(
+            "Run time {:.1f}s, {} call(s)\n\n".format(
+                time.monotonic() - self.started, sum(e[0] for e in ops.values())
+            )
+        )
+        fh.write(
+            "{:10} {:40} {:>7} {:>10} {:>9} {:>9}\n".format(
+                "kind", "operation", "calls", "total", "mean", "max"
+            )
+        )
+        for (kind, op), (count, total, longest) in sorted(
+            ops.items(), key=lambda i: i[1][1], reverse=True
+        ):
+            fh.write(
+                "{:10} {:40} {:7d} {:9.1f}s {:8.2f}s {:8.2f}s\n".format(
+                    kind, op[:40], count, total, total / count, longest
+                )
+            )
+        fh.write("\n{:40} {:>18} {:>18} {:>18}\n".format("component", *kinds))
+        for comp, entry in sorted(
+            comps.items(),
+            key=lambda i: sum(e[1] for e in i[1].values()),
+            reverse=True,
+        ):
+            fh.write(
+                "{:40} {}\n".format(
+                    comp[:40],
+                    " ".join(
+                        "{:6d} {:10.1f}s".format(*entry.get(kind, [0, 0.0]))
+                        for kind in kinds
+                    ),
+                )
+            )
+        fh.write("\nSlowest calls:\n")
+        for duration, comp, kind, detail in slowest:
+            fh.write("{:9.2f}s {:30} {:10} {}\n".format(duration, comp, kind, detail))
+
+
+# the kinds of calls accounted, in report order
+kinds = ("git", "lookaside", "http")
+
+_profiler = None
+_installed = False
+
+
+def profiler():
+    """Returns the profiler hooks record into, or None if not installed."""
+    return _profiler
+
+
+def _git_op(command):
+    """Returns the subcommand of a git command line."""
+    if isinstance(command, str):
+        command = command.split()
+    args = list(command[1:])
+    while args and args[0].startswith("-"):
+        # skip global options, and the values of -C and -c
+        if args.pop(0) in ("-C", "-c") and args:
+            args.pop(0)
+    return "git {}".format(args[0]) if args else "git"
+
+
+def _redact(url):
+    """Strips credentials and the query from a URL for the report."""
+    parts = urllib.parse.urlsplit(url)
+    return "{}://{}{}".format(parts.scheme, parts.hostname or "", parts.path)
+
+
+def _http_op(method, url):
+    """Returns the operation of an HTTP request: the method and the host
+    and first path element, so that requests for different files of the
+    same service are accounted together."""
+    parts = urllib.parse.urlsplit(url)
+    path = re.sub(r"^(/[^/]*).*", r"\1", parts.path)
+    return "{} {}{}".format(method.upper(), parts.hostname or "", path)
+
+
+def install():
+    """Starts accounting.  Wraps GitPython command execution, the pyrpkg
+    lookaside cache operations, requests sessions and git commands run
+    through subprocess.  The wrappers stay installed; only the first call
+    installs them.
+
+    :returns: The Profiler
+    """
+    global _profiler, _installed
+    if _profiler is None:
+        _profiler = Profiler()
+    if _installed:
+        return _profiler
+    _installed = True
+
+    try:
+        import git
+    except ImportError:
+        git = None
+    if git is not None:
+        execute = git.cmd.Git.execute
+
+        @functools.wraps(execute)
+        def git_execute(self, command, *args, **kwargs):
+            detail = command if isinstance(command, str) else " ".join(command)
+            with _profiler.timed("git", _git_op(command), detail):
+                return execute(self, command, *args, **kwargs)
+
+        git.cmd.Git.execute = git_execute
+
+    run = subprocess.run
+
+    @functools.wraps(run)
+    def subprocess_run(args, *a, **kw):
+        if isinstance(args, (list, tuple)) and args and args[0] == "git":
+            with _profiler.timed("git", _git_op(args), " ".join(args)):
+                return run(args, *a, **kw)
+        return run(args, *a, **kw)
+
+    subprocess.run = subprocess_run
+
+    try:
+        import requests
+    except ImportError:
+        requests = None
+    if requests is not None:
+        request = requests.Session.request
+
+        @functools.wraps(request)
+        def session_request(self, method, url, *args, **kwargs):
+            with _profiler.timed(
+                "http", _http_op(method, url), "{} {}".format(method, _redact(url))
+            ):
+                return request(self, method, url, *args, **kwargs)
+
+        requests.Session.request = session_request
+
+    try:
+        import pyrpkg.lookaside
+    except ImportError:
+        pyrpkg = None
+    if pyrpkg is not None:
+        cls = pyrpkg.lookaside.CGILookasideCache
+        for name in ("download", "remote_file_exists", "upload"):
+            method = getattr(cls, name)
+
+            def wrapper(self, *args, _method=method, _name=name, **kwargs):
+                detail = "{} {}".format(
+                    _name, "/".join(str(a) for a in args[:2] if isinstance(a, str))
+                )
+                with _profiler.timed("lookaside", _name, detail):
+                    return _method(self, *args, **kwargs)
+
+            setattr(cls, name, functools.wraps(method)(wrapper))
+
+    return _profiler
+
+
+@contextlib.contextmanager
+def component_profile(directory, name):
+    """Captures cProfile data of the calling thread within the context
+    into directory/name.prof, if directory is set.  Work done on other
+    threads, such as lookaside transfers, is not included.
+
+    :param directory: The directory for the profile data, or None
+    :param name: The component, as namespace/component
+    """
+    if not directory:
+        yield
+        return
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        # only one profiler can be active at a time on newer Pythons
+        logger.warning("Cannot profile %s, another profile is active.", name)
+        yield
+        return
+    try:
+        yield
+    finally:
+        prof.disable()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, re.sub(r"[^A-Za-z0-9._+-]", "_", name) + ".prof")
+        try:
+            prof.dump_stats(path)
+        except Exception:
+            logger.warning("Cannot write profile %s.", path, exc_info=True)
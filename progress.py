@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+# Live progress of an import run: components done, in flight and queued,
+# the phases they are in, lookaside bytes still to transfer, transfer
+# rates and an estimated time of arrival, shown as a terminal status line
+# and written to a JSON status file.
+
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import lookaside
+
+logger = logging.getLogger(__name__)
+
+
+class Tracker(object):
+    """Counts the components and lookaside bytes of a run.  Components are
+    identified by (job name, namespace, component) tuples, so that the same
+    component imported by several jobs is tracked once per job.  Safe to
+    share between threads; all updates are cheap."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.queued = 0
+        self.inflight = {}
+        self.done = 0
+        self.failed = 0
+        self.bytes_queued = 0
+        self.bytes_done = 0
+        self._samples = collections.deque(maxlen=30)
+
+    def add(self, count=1):
+        """Adds components to the queue."""
+        with self._lock:
+            self.queued += count
+
+    def start(self, component):
+        """Moves a component from the queue to the in flight set."""
+        with self._lock:
+            self.queued = max(0, self.queued - 1)
+            self.inflight[component] = None
+
+    def phase(self, component, name):
+        """Records the phase an in flight component entered."""
+        with self._lock:
+            if component in self.inflight:
+                self.inflight[component] = name
+
+    def finish(self, component, ok):
+        """Records the end of a component import."""
+        with self._lock:
+            self.inflight.pop(component, None)
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def transfer_queued(self, nbytes):
+        """Records lookaside bytes queued for transfer."""
+        with self._lock:
+            self.bytes_queued += nbytes
+
+    def transfer_done(self, nbytes):
+        """Records lookaside bytes whose transfer finished or was skipped."""
+        with self._lock:
+            self.bytes_done += nbytes
+
+    def snapshot(self):
+        """Returns the current state as a dict, including the transfer
+        rates over the last samples and the estimated remaining time."""
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append(
+                (now, lookaside.download_limit.total, lookaside.upload_limit.total)
+            )
+            first = self._samples[0]
+            phases = collections.Counter(
+                p or "starting" for p in self.inflight.values()
+            )
+            state = {
+                "time": time.time(),
+                "elapsed": round(now - self.started, 1),
+                "components": {
+                    "done": self.done,
+                    "failed": self.failed,
+                    "inflight": len(self.inflight),
+                    "queued": self.queued,
+                },
+                "phases": dict(phases),
+                "bytes_remaining": max(0, self.bytes_queued - self.bytes_done),
+            }
+        span = now - first[0]
+        state["download_rate"] = (
+            (lookaside.download_limit.total - first[1]) / span if span else 0.0
+        )
+        state["upload_rate"] = (
+            (lookaside.upload_limit.total - first[2]) / span if span else 0.0
+        )
+        state["eta"] = self._eta(state)
+        return state
+
+    @staticmethod
+    def _eta(state):
+        comps = state["components"]
+        finished = comps["done"] + comps["failed"]
+        eta = None
+        if finished:
+            # in flight components are about half done on average
+            eta = (
+                state["elapsed"]
+                / finished
+                * (comps["queued"] + comps["inflight"] / 2.0)
+            )
+        if state["bytes_remaining"] and state["download_rate"] > 0:
+            eta = max(eta or 0.0, state["bytes_remaining"] / state["download_rate"])
+        return round(eta, 1) if eta is not None else None
+
+
+# the tracker of this process
+tracker = Tracker()
+
+
+def _duration(seconds):
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return "{:02d}:{:02d}:{:02d}".format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60
+    )
+
+
+def _size(nbytes):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if nbytes < 1024 or unit == "GiB":
+            return "{:.1f} {}".format(nbytes, unit)
+        nbytes /= 1024.0
+
+
+def status_line(state):
+    """Formats a state snapshot as a single line."""
+    comps = state["components"]
+    return (
+        "[{} done, {} failed, {} running, {} queued] {} | "
+        "down {}/s up {}/s | {} left | ETA {}"
+    ).format(
+        comps["done"],
+        comps["failed"],
+        comps["inflight"],
+        comps["queued"],
+        " ".join("{}:{}".format(p, n) for p, n in sorted(state["phases"].items()))
+        or "-",
+        _size(state["download_rate"]),
+        _size(state["upload_rate"]),
+        _size(state["bytes_remaining"]),
+        _duration(state["eta"]),
+    )
+
+
+class Reporter(object):
+    """Periodically shows the state of the tracker as a status line on a
+    terminal and rewrites a JSON status file for dashboards.
+
+    :param path: The JSON status file, or None
+    :param line: Show the status line; only done if stderr is a terminal
+    :param interval: The number of seconds between status line updates
+    :param write_every: The number of seconds between status file writes
+    """
+
+    def __init__(self, path=None, line=True, interval=1.0, write_every=5.0):
+        self.path = path
+        self.line = line and sys.stderr.isatty()
+        self.interval = interval
+        self.write_every = write_every
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self.path and not self.line:
+            return self
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        written = 0.0
+        while not self._stop.wait(self.interval):
+            state = tracker.snapshot()
+            if self.line:
+                sys.stderr.write("\r\x1b[K" + status_line(state))
+                sys.stderr.flush()
+            if self.path and time.monotonic() - written >= self.write_every:
+                written = time.monotonic()
+                self.write(state)
+
+    def write(self, state):
+        """Atomically rewrites the status file."""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmpname = "{}.{}".format(self.path, os.getpid())
+            with open(tmpname, "w") as fh:
+                json.dump(state, fh, indent=2)
+            os.replace(tmpname, self.path)
+        except Exception:
+            logger.warning("Cannot write status file %s.", self.path, exc_info=True)
+
+    def stop(self):
+        """Stops reporting, writing the final state."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self.line:
+            sys.stderr.write("\r\x1b[K")
+            sys.stderr.flush()
+        if self.path:
+            self.write(tracker.snapshot())
@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+
+# Disk-budgeted cache of persistent component repositories.
+#
+# Usage: repocache.py [--maintain SECONDS] [--budget BYTES] root
+
+import argparse
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# git commands run on idle repositories to keep fetches and merges fast
+maintenance = [
+    ["config", "core.commitGraph", "true"],
+    ["config", "fetch.writeCommitGraph", "true"],
+    # maintenance is done here, not in the middle of an import
+    ["config", "gc.auto", "0"],
+    ["commit-graph", "write", "--reachable", "--split", "--changed-paths"],
+    ["maintenance", "run", "--task=loose-objects"],
+    ["multi-pack-index", "write"],
+    ["maintenance", "run", "--task=incremental-repack"],
+    ["prune", "--expire=2.weeks.ago"],
+]
+
+
+def disk_usage(path):
+    """Returns the disk space used by a directory tree in bytes, like du."""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += st.st_blocks * 512
+    return total
+
+
+class RepoCache(object):
+    """Keeps component repositories under a common root between runs and
+    evicts the least recently used ones to stay within a disk budget.
+
+    The last use time and size of each repository are kept in a JSON state
+    file in the root directory, guarded by a file lock so that several
+    processes can share the cache.  Repositories that are in use by this
+    process are never evicted.
+
+    :param root: The directory holding the repositories
+    :param budget: The disk budget in bytes, or None for no limit
+    """
+
+    def __init__(self, root, budget=None):
+        # repositories are keyed by absolute path, so that the same one is
+        # never recorded twice under different spellings
+        self.root = os.path.abspath(root)
+        self.budget = budget
+        self.statefile = os.path.join(self.root, ".repocache.json")
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._active = {}
+
+    @contextlib.contextmanager
+    def _state(self):
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(self.statefile + ".lock", "w") as lockfh:
+            fcntl.flock(lockfh, fcntl.LOCK_EX)
+            state = {}
+            if os.path.isfile(self.statefile):
+                try:
+                    with open(self.statefile, "r") as fh:
+                        state = json.load(fh)
+                except Exception:
+                    logger.warning("Cannot read %s, rebuilding.", self.statefile)
+            # relative entries written by older versions are found again below
+            state = {k: v for k, v in state.items() if os.path.isabs(k)}
+            # pick up repositories the state file does not know about yet
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if path not in state and os.path.isdir(path):
+                    state[path] = {
+                        "used": os.path.getmtime(path),
+                        "size": disk_usage(path),
+                    }
+            for path in list(state):
+                if not os.path.isdir(path):
+                    del state[path]
+            yield state
+            tmpname = "{}.{}".format(self.statefile, os.getpid())
+            with open(tmpname, "w") as fh:
+                json.dump(state, fh, indent=2)
+            os.replace(tmpname, self.statefile)
+
+    def _evict(self, state, needed):
+        total = sum(e["size"] for e in state.values())
+        if self.budget is None or total + needed <= self.budget:
+            return
+        for path, entry in sorted(state.items(), key=lambda i: i[1]["used"]):
+            if total + needed <= self.budget:
+                break
+            if path in self._active:
+                continue
+            # another process, such as an isolated worker, may be using it
+            with self._repo_lock(path, blocking=False) as locked:
+                if not locked:
+                    logger.debug("Repository %s is in use, not evicting it.", path)
+                    continue
+                logger.info(
+                    "Evicting repository %s (%d bytes) to stay within the %d "
+                    "byte repository budget.",
+                    path,
+                    entry["size"],
+                    self.budget,
+                )
+                shutil.rmtree(path, ignore_errors=True)
+            total -= entry["size"]
+            del state[path]
+        if total + needed > self.budget:
+            logger.warning(
+                "Repositories in use need %d bytes, over the %d byte budget.",
+                total + needed,
+                self.budget,
+            )
+
+    @contextlib.contextmanager
+    def use(self, path):
+        """Marks a repository as in use for the duration of the context.
+        Before entering, least recently used repositories are evicted to
+        make room for it; afterwards its size and last use time are
+        recorded.
+
+        :param path: The repository directory, below the cache root
+        """
+        path = os.path.abspath(path)
+        with self._state() as state:
+            needed = 0 if path in state else self.expected_size(state)
+            self._active[path] = self._active.get(path, 0) + 1
+            lock = self._locks.setdefault(path, threading.Lock())
+            self._evict(state, needed)
+        try:
+            with lock, self._repo_lock(path):
+                yield path
+        finally:
+            with self._state() as state:
+                self._active[path] -= 1
+                if not self._active[path]:
+                    del self._active[path]
+                if os.path.isdir(path):
+                    entry = state.setdefault(path, {})
+                    entry["used"] = time.time()
+                    entry["size"] = disk_usage(path)
+                self._evict(state, 0)
+
+    @contextlib.contextmanager
+    def _repo_lock(self, path, blocking=True):
+        """Holds the lock file of a repository, shared with other processes.
+        Yields False instead if blocking is off and the lock is taken."""
+        lockname = os.path.join(self.root, ".{}.lock".format(os.path.basename(path)))
+        with open(lockname, "w") as lockfh:
+            try:
+                fcntl.flock(
+                    lockfh, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                )
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def maintain(self, seconds):
+        """Runs git maintenance on idle repositories within a time budget.
+        Repositories used since their last maintenance go first, the most
+        recently used of them first.  Repositories that are in use, here or
+        by another process, are skipped.
+
+        :param seconds: The time budget in seconds
+        :returns: The number of repositories maintained
+        """
+        deadline = time.monotonic() + seconds
+        with self._state() as state:
+            todo = sorted(
+                (
+                    path
+                    for path, entry in state.items()
+                    if entry["used"] > entry.get("maintained", 0)
+                    and os.path.isdir(os.path.join(path, ".git"))
+                ),
+                key=lambda path: state[path]["used"],
+                reverse=True,
+            )
+        done = 0
+        for path in todo:
+            if time.monotonic() >= deadline:
+                logger.info(
+                    "Maintenance time budget used up, %d repositories left.",
+                    len(todo) - done,
+                )
+                break
+            if path in self._active:
+                continue
+            with self._repo_lock(path, blocking=False) as locked:
+                if not locked:
+                    logger.debug("Repository %s is in use, skipping.", path)
+                    continue
+                started = time.monotonic()
+                try:
+                    for cmd in maintenance:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise subprocess.TimeoutExpired(cmd, 0)
+                        subprocess.run(
+                            ["git", "-C", path] + cmd,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE,
+                            timeout=remaining,
+                            check=True,
+                        )
+                except subprocess.TimeoutExpired:
+                    logger.info(
+                        "Maintenance of %s interrupted by the time budget.", path
+                    )
+                    break
+                except subprocess.CalledProcessError as e:
+                    logger.warning(
+                        "Maintenance of %s failed: %s",
+                        path,
+                        e.stderr.decode("utf-8", "replace").strip(),
+                    )
+                    continue
+            logger.debug("Maintained %s in %.1fs.", path, time.monotonic() - started)
+            with self._state() as state:
+                if path in state:
+                    state[path]["size"] = disk_usage(path)
+                    state[path]["maintained"] = time.time()
+            done += 1
+        return done
+
+    @staticmethod
+    def expected_size(state):
+        """Guesses the size of a new repository from the cached ones."""
+        if not state:
+            return 0
+        return sum(e["size"] for e in state.values()) // len(state)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evict and maintain cached component repositories."
+    )
+    parser.add_argument("root", help="The directory holding the repositories")
+    parser.add_argument(
+        "-b",
+        "--budget",
+        type=int,
+        help="Evict least recently used repositories above this many bytes",
+        default=None,
+    )
+    parser.add_argument(
+        "-m",
+        "--maintain",
+        type=int,
+        metavar="SECONDS",
+        help="Run git maintenance on idle repositories for up to SECONDS",
+        default=0,
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    cache = RepoCache(args.root, args.budget)
+    with cache._state() as state:
+        cache._evict(state, 0)
+    if args.maintain:
+        cache.maintain(args.maintain)
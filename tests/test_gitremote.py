@@ -0,0 +1,63 @@
+# Tests of the git archive fallback of gitremote.read_file(), against a
+# local repository served through file:// like a remote one.
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import gitremote  # noqa: E402
+
+
+def git(cwd, *args):
+    return subprocess.run(
+        ["git", "-C", cwd] + list(args),
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout.strip()
+
+
+class ReadFileArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.repo = os.path.join(self.tmp.name, "repo")
+        subprocess.run(["git", "init", "-q", "-b", "c9s", self.repo], check=True)
+        git(self.repo, "config", "user.name", "test")
+        git(self.repo, "config", "user.email", "test@example.com")
+        self.commit("sources", "SHA512 (a.tar.gz) = 01\n")
+        self.link = "file://" + self.repo
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def commit(self, path, content):
+        with open(os.path.join(self.repo, path), "w") as fh:
+            fh.write(content)
+        git(self.repo, "add", path)
+        git(self.repo, "commit", "-q", "-m", path)
+        return git(self.repo, "rev-parse", "HEAD")
+
+    def test_reads_branch_at_commit(self):
+        tip = gitremote.ls_remote(self.link, "c9s")
+        self.assertEqual(
+            gitremote.read_file(self.link, "c9s", "sources", commit=tip),
+            "SHA512 (a.tar.gz) = 01\n",
+        )
+
+    def test_missing_file(self):
+        tip = gitremote.ls_remote(self.link, "c9s")
+        self.assertIsNone(gitremote.read_file(self.link, "c9s", "missing", commit=tip))
+
+    def test_moved_branch(self):
+        tip = gitremote.ls_remote(self.link, "c9s")
+        self.commit("sources", "SHA512 (b.tar.gz) = 02\n")
+        with self.assertRaises(ValueError):
+            gitremote.read_file(self.link, "c9s", "sources", commit=tip)
+
+
+if __name__ == "__main__":
+    unittest.main()